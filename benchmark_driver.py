@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Measures the round-trip time of individual WebDriver commands for the 'hub' and 'local'
+driver backends, to see how much of a query's non-generation latency the hub hop costs.
+
+Usage:
+    python benchmark_driver.py --backend hub --hub-url http://localhost:4444/wd/hub
+    python benchmark_driver.py --backend local --backend hub --iterations 500
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+# Importing the app module must not start a browser or touch the database.
+os.environ.setdefault('STARTUP_MODE', 'lazy')
+
+from latency import percentile
+
+# A static page with the elements the query flow looks up, so no network access is needed.
+BENCHMARK_PAGE = 'data:text/html,<textarea data-testid="chat-input"></textarea><div class="message-content">Answer</div>'
+
+COMMANDS = {
+    'current_url': lambda driver: driver.current_url,
+    'find_elements': lambda driver: driver.find_elements('css selector', '.message-content'),
+    'element_text': lambda driver: driver.find_element('css selector', '.message-content').text,
+    'execute_script': lambda driver: driver.execute_script('return document.readyState'),
+}
+
+def benchmark_backend(backend, hub_url, iterations):
+    """Starts a driver for the backend and times each command `iterations` times."""
+    import notebooklm
+
+    started = time.perf_counter()
+    driver = notebooklm.create_undetected_driver(notebooklm.LOCAL_DRIVER if backend == 'local' else hub_url)
+    startup_seconds = time.perf_counter() - started
+    try:
+        driver.get(BENCHMARK_PAGE)
+        results = {}
+        for name, command in COMMANDS.items():
+            command(driver)  # Warm-up, so connection setup is not counted.
+            samples = []
+            for _ in range(iterations):
+                command_started = time.perf_counter()
+                command(driver)
+                samples.append((time.perf_counter() - command_started) * 1000)
+            results[name] = {
+                'mean_ms': round(sum(samples) / len(samples), 3),
+                'p50_ms': round(percentile(samples, 50), 3),
+                'p95_ms': round(percentile(samples, 95), 3),
+            }
+        return {'backend': backend, 'startup_seconds': round(startup_seconds, 2), 'commands': results}
+    finally:
+        driver.quit()
+
+def print_report(report):
+    print(f"\n📊 {report['backend']} backend (driver started in {report['startup_seconds']}s)")
+    print(f"   {'command':<16}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for name, stats in report['commands'].items():
+        print(f"   {name:<16}{stats['mean_ms']:>10}{stats['p50_ms']:>10}{stats['p95_ms']:>10}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark per-command WebDriver round-trip times.')
+    parser.add_argument('--backend', action='append', choices=['hub', 'local'],
+                        help="Backend to measure; repeat to compare (default: both)")
+    parser.add_argument('--hub-url', default=os.environ.get('SELENIUM_HUB_URL', 'http://localhost:4444/wd/hub'))
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+    args = parser.parse_args()
+
+    # Use a throwaway profile so the benchmark does not compete with a running app for its profile.
+    os.environ.setdefault('CHROME_USER_DATA_DIR', tempfile.mkdtemp(prefix='driver-benchmark-'))
+
+    reports = []
+    for backend in args.backend or ['hub', 'local']:
+        try:
+            reports.append(benchmark_backend(backend, args.hub_url, args.iterations))
+        except Exception as e:
+            print(f"❌ Could not benchmark the {backend} backend: {e}", file=sys.stderr)
+    if args.json:
+        print(json.dumps(reports, indent=2))
+    else:
+        for report in reports:
+            print_report(report)
+    return bool(reports)
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
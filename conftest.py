@@ -0,0 +1,6 @@
+import os
+import tempfile
+
+# Tests run against a throwaway database instead of database/app.db. This has to be set
+# before main is imported, since the app reads it when it configures SQLAlchemy.
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='notebooklm-tests-'), 'app.db')}"
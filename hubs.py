@@ -0,0 +1,175 @@
+import bisect
+import hashlib
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+def _hash(value):
+    return int(hashlib.md5(value.encode('utf-8')).hexdigest()[:16], 16)
+
+class HubRing:
+    """
+    Consistent hash ring over Selenium hub URLs. Each hub is placed on the ring many
+    times (virtual nodes) so notebooks spread evenly, and adding or removing a hub only
+    moves the notebooks that hashed to it.
+    """
+
+    def __init__(self, hub_urls, replicas=100):
+        self.hub_urls = list(dict.fromkeys(hub_urls))
+        self._ring = sorted(
+            (_hash(f"{hub_url}#{replica}"), hub_url)
+            for hub_url in self.hub_urls
+            for replica in range(replicas)
+        )
+        self._keys = [point for point, _ in self._ring]
+
+    def preference_list(self, key):
+        """Returns every hub in the order they should be tried for `key`."""
+        if not self._ring:
+            return []
+        start = bisect.bisect(self._keys, _hash(key)) % len(self._ring)
+        ordered = []
+        for offset in range(len(self._ring)):
+            hub_url = self._ring[(start + offset) % len(self._ring)][1]
+            if hub_url not in ordered:
+                ordered.append(hub_url)
+                if len(ordered) == len(self.hub_urls):
+                    break
+        return ordered
+
+class Hub:
+    """Health and load of a single Selenium hub."""
+
+    def __init__(self, url):
+        self.url = url
+        self.healthy = True
+        self.last_checked = 0.0
+        self.last_error = None
+        self.consecutive_failures = 0
+        self.active_queries = 0
+
+    def to_dict(self):
+        return {
+            'url': self.url,
+            'healthy': self.healthy,
+            'active_queries': self.active_queries,
+            'consecutive_failures': self.consecutive_failures,
+            'last_error': self.last_error,
+            'last_checked': self.last_checked or None
+        }
+
+class HubRouter:
+    """
+    Routes notebook URLs to Selenium hubs with consistent hashing, skipping hubs whose
+    status check fails so that their notebooks fail over to the next hub on the ring.
+    Status checks run in a background thread (see start), so routing never waits on a hub.
+    """
+
+    def __init__(self, hub_urls, replicas=100, check_interval=30, check_timeout=5):
+        self.ring = HubRing(hub_urls, replicas)
+        self.hubs = {hub_url: Hub(hub_url) for hub_url in self.ring.hub_urls}
+        self.check_interval = check_interval
+        self.check_timeout = check_timeout
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def primary(self):
+        """The first configured hub, used when a request does not name a notebook."""
+        return self.ring.hub_urls[0]
+
+    def route(self, notebook_url):
+        """
+        Returns the hub URL for a notebook: the first healthy hub in its preference list.
+        If every hub is failing, the notebook's own hub is returned so the caller gets a real error.
+        """
+        preference = self.ring.preference_list(notebook_url)
+        for hub_url in preference:
+            if self.is_healthy(hub_url):
+                return hub_url
+        return preference[0]
+
+    def is_healthy(self, hub_url):
+        """Returns the hub's health as of its last status check or browser start."""
+        return self.hubs[hub_url].healthy
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """
+        Starts checking every hub's status each check_interval seconds in a background thread.
+        With a single hub there is nothing to fail over to, so no checks are run.
+        Safe to call more than once.
+        """
+        with self._lock:
+            if self.running or len(self.hubs) < 2:
+                return False
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='hub-health-checks', daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.check_all()
+            self._stop.wait(self.check_interval)
+
+    def check_all(self):
+        """Checks every hub once. Returns the URLs of the healthy hubs."""
+        return [hub_url for hub_url in self.ring.hub_urls if self.check(hub_url)]
+
+    def check(self, hub_url):
+        """Queries the hub's /status endpoint and records the result."""
+        import requests
+
+        try:
+            response = requests.get(f"{hub_url.rstrip('/')}/status", timeout=self.check_timeout)
+            response.raise_for_status()
+            ready = response.json().get('value', {}).get('ready', True)
+            if not ready:
+                raise RuntimeError('Hub reports it is not ready')
+        except Exception as e:
+            self.mark_failed(hub_url, e)
+            return False
+        self.mark_healthy(hub_url)
+        return True
+
+    def mark_failed(self, hub_url, error):
+        with self._lock:
+            hub = self.hubs[hub_url]
+            if hub.healthy:
+                logger.warning(f"Selenium hub {hub_url} is unhealthy, failing over: {error}")
+            hub.healthy = False
+            hub.last_checked = time.time()
+            hub.last_error = str(error)
+            hub.consecutive_failures += 1
+
+    def mark_healthy(self, hub_url):
+        with self._lock:
+            hub = self.hubs[hub_url]
+            if not hub.healthy:
+                logger.info(f"Selenium hub {hub_url} is healthy again.")
+            hub.healthy = True
+            hub.last_checked = time.time()
+            hub.last_error = None
+            hub.consecutive_failures = 0
+
+    def query_started(self, hub_url):
+        with self._lock:
+            self.hubs[hub_url].active_queries += 1
+
+    def query_finished(self, hub_url):
+        with self._lock:
+            self.hubs[hub_url].active_queries -= 1
+
+    def snapshot(self):
+        with self._lock:
+            return [hub.to_dict() for hub in self.hubs.values()]
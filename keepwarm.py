@@ -0,0 +1,105 @@
+import logging
+import threading
+from datetime import timedelta
+
+logger = logging.getLogger(__name__)
+
+def parse_schedule(value):
+    """Parses comma-separated HH:MM times of day into a sorted list of (hour, minute) tuples."""
+    schedule = []
+    for item in (value or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            hour, minute = (int(part) for part in item.split(':'))
+        except ValueError:
+            raise ValueError(f"Invalid time of day '{item}', expected HH:MM") from None
+        if not (0 <= hour < 24 and 0 <= minute < 60):
+            raise ValueError(f"Invalid time of day '{item}'")
+        schedule.append((hour, minute))
+    return sorted(schedule)
+
+def next_scheduled_time(schedule, now):
+    """Returns the first scheduled datetime at or after `now`, or None without a schedule."""
+    candidates = []
+    for hour, minute in schedule:
+        at = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        candidates.append(at if at >= now else at + timedelta(days=1))
+    return min(candidates) if candidates else None
+
+class KeepWarmPlanner:
+    """
+    Decides what the keep-warm scheduler does for a browser session. Sessions are touched
+    once they have been idle for `idle_seconds`, and their notebook page is reloaded once it
+    has been open for `refresh_seconds`, ahead of the sign-in or page state expiring.
+    Pinned notebooks are re-opened `lead_seconds` before each scheduled time of day, or
+    once at startup when there is no schedule.
+    """
+
+    def __init__(self, idle_seconds=300, refresh_seconds=3000, schedule=None, lead_seconds=300):
+        self.idle_seconds = idle_seconds
+        self.refresh_seconds = refresh_seconds
+        self.schedule = schedule or []
+        self.lead_seconds = lead_seconds
+        self._warmed_slots = set()
+
+    def session_action(self, idle_for, page_age):
+        """Returns 'refresh', 'touch' or None for a session with an open notebook."""
+        if self.refresh_seconds and page_age is not None and page_age >= self.refresh_seconds:
+            return 'refresh'
+        if self.idle_seconds and idle_for >= self.idle_seconds:
+            return 'touch'
+        return None
+
+    def pinned_slot(self, now):
+        """
+        Returns an identifier for the upcoming traffic window if pinned notebooks are due to be
+        re-opened for it at `now` (a datetime), otherwise None.
+        """
+        if not self.schedule:
+            return 'startup'
+        at = next_scheduled_time(self.schedule, now)
+        if at - now <= timedelta(seconds=self.lead_seconds):
+            return at.isoformat()
+        return None
+
+    def is_warmed(self, notebook, slot):
+        return (notebook, slot) in self._warmed_slots
+
+    def mark_warmed(self, notebook, slot):
+        self._warmed_slots.add((notebook, slot))
+
+class KeepWarmScheduler:
+    """Calls `tick` every `interval` seconds on a daemon thread until stopped."""
+
+    def __init__(self, tick, interval=60):
+        self.tick = tick
+        self.interval = interval
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        with self._lock:
+            if self.running:
+                return False
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='keep-warm', daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        logger.info(f"Keep-warm scheduler started (every {self.interval} seconds).")
+        while not self._stop.wait(self.interval):
+            try:
+                self.tick()
+            except Exception as e:
+                logger.error(f"Keep-warm pass failed: {e}", exc_info=True)
@@ -0,0 +1,78 @@
+import math
+import threading
+from collections import defaultdict, deque
+
+# Answer length buckets (upper bound in characters, name). Anything longer is 'long'.
+LENGTH_BUCKETS = [
+    (500, 'short'),
+    (2000, 'medium')
+]
+LONG_BUCKET = 'long'
+
+def length_bucket(answer_length):
+    """Returns the name of the bucket an answer of the given length falls into."""
+    for upper_bound, name in LENGTH_BUCKETS:
+        if answer_length <= upper_bound:
+            return name
+    return LONG_BUCKET
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a non-empty sequence of numbers."""
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[rank - 1]
+
+class LatencyTracker:
+    """
+    Keeps a rolling window of answer times per notebook and answer length bucket,
+    and derives query deadlines from their percentiles.
+    """
+
+    def __init__(self, max_samples=200, min_samples=5):
+        self.min_samples = min_samples
+        self._samples = defaultdict(lambda: deque(maxlen=max_samples))
+        self._lock = threading.Lock()
+
+    def record(self, notebook, seconds, answer_length):
+        with self._lock:
+            self._samples[(notebook, length_bucket(answer_length))].append(seconds)
+
+    def samples(self, notebook, bucket=None):
+        """Returns the recorded answer times for a notebook, optionally limited to one bucket."""
+        with self._lock:
+            return [
+                seconds
+                for (sample_notebook, sample_bucket), values in self._samples.items()
+                if sample_notebook == notebook and (bucket is None or sample_bucket == bucket)
+                for seconds in values
+            ]
+
+    def adaptive_timeout(self, notebook, pct, margin, minimum, maximum, default, bucket=None):
+        """
+        Picks a deadline for the next query against `notebook`.
+        Returns a (timeout in seconds, basis) tuple, where basis describes where the value came from.
+        Falls back to the whole notebook if the bucket has too few samples, then to `default`.
+        """
+        candidates = [bucket, None] if bucket else [None]
+        for candidate in candidates:
+            samples = self.samples(notebook, candidate)
+            if len(samples) >= self.min_samples:
+                timeout = percentile(samples, pct) * margin
+                basis = f"p{pct:g}" + (f"/{candidate}" if candidate else '')
+                return int(math.ceil(min(max(timeout, minimum), maximum))), basis
+        return int(min(default, maximum)), 'default'
+
+    def snapshot(self, pct=95):
+        """Summarises the tracked distributions for reporting."""
+        with self._lock:
+            items = [(key, list(values)) for key, values in self._samples.items() if values]
+        stats = []
+        for (notebook, bucket), values in items:
+            stats.append({
+                'notebook': notebook,
+                'length_bucket': bucket,
+                'samples': len(values),
+                'p50_seconds': round(percentile(values, 50), 2),
+                f"p{pct:g}_seconds": round(percentile(values, pct), 2)
+            })
+        return stats
@@ -1,16 +1,34 @@
+import time
+_import_started = time.perf_counter()
+
 import os
+import re
 import threading
 import signal
 import logging
-from flask import Flask, send_from_directory
+from flask import Flask, g, jsonify, request, send_from_directory
 from flask_cors import CORS
 from models import db
 from user import user_bp
-from notebooklm import notebooklm_bp, browser_instance, browser_lock, start_browser_initialization_thread
+from tracing import tracer, TRACE_ID_HEADER
+from webhooks import webhook_dispatcher
+from responses import compress_response
+import notebooklm
+from notebooklm import notebooklm_bp, close_all_browsers, start_browser_initialization_thread, ensure_browser_initialization_started, start_keep_warm, hub_router
 
 # Configure logging for the application
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
+# 'eager' creates the database tables, signal handlers and browser when the module is imported.
+# 'lazy' defers them until first use (or /api/warmup), for fast serverless cold starts.
+STARTUP_MODE = os.environ.get('STARTUP_MODE', 'eager')
+if STARTUP_MODE not in ('eager', 'lazy'):
+    logging.warning(f"Unknown STARTUP_MODE '{STARTUP_MODE}', falling back to 'eager'.")
+    STARTUP_MODE = 'eager'
+
+# Cold-start timings, reported by /api/startup_metrics.
+startup_metrics = {'startup_mode': STARTUP_MODE}
+
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 
 # Load secret key from environment variable for better security
@@ -19,8 +37,40 @@ if SECRET_KEY == 'a-default-insecure-secret-key-for-dev' and os.environ.get('FLA
     logging.warning("SECURITY WARNING: Using default insecure secret key in production. Set the FLASK_SECRET_KEY environment variable.")
 app.config['SECRET_KEY'] = SECRET_KEY
 
-# Enable CORS for all routes
-CORS(app)
+# Enable CORS for all routes, letting browsers read the trace id header
+CORS(app, expose_headers=[TRACE_ID_HEADER])
+
+# --- Request Tracing ---
+# Every request gets a trace id (an incoming X-Trace-Id is reused), returned in the response
+# headers. Spans of sampled requests are exported to a JSONL file by the tracer.
+VALID_TRACE_ID = re.compile(r'^[A-Za-z0-9-]{8,64}$')
+
+@app.before_request
+def start_request_trace():
+    incoming_trace_id = request.headers.get(TRACE_ID_HEADER, '')
+    tracer.start_trace(incoming_trace_id if VALID_TRACE_ID.match(incoming_trace_id) else None)
+    g.request_span = tracer.start_span('http.request', method=request.method, path=request.path)
+
+@app.after_request
+def add_trace_header(response):
+    trace_id = tracer.current_trace_id()
+    if trace_id:
+        response.headers[TRACE_ID_HEADER] = trace_id
+    if g.get('request_span'):
+        g.request_span.set_attribute('status_code', response.status_code)
+    return response
+
+@app.teardown_request
+def end_request_trace(error=None):
+    tracer.end_span(g.pop('request_span', None), error)
+    tracer.end_trace()
+
+# --- Response Compression ---
+# JSON and text bodies above COMPRESSION_MIN_SIZE, and NDJSON/SSE streams, are compressed
+# with brotli (if installed) or gzip according to the client's Accept-Encoding.
+@app.after_request
+def compress(response):
+    return compress_response(response, request.accept_encodings)
 
 app.register_blueprint(user_bp, url_prefix='/api')
 app.register_blueprint(notebooklm_bp, url_prefix='/api')
@@ -29,30 +79,85 @@ app.register_blueprint(notebooklm_bp, url_prefix='/api')
 db_path = os.path.join(os.path.dirname(__file__), 'database')
 os.makedirs(db_path, exist_ok=True)
 
-app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(db_path, 'app.db')}"
+# DATABASE_URL points the app at another database, e.g. a throwaway one for tests.
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', f"sqlite:///{os.path.join(db_path, 'app.db')}")
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db.init_app(app)
-with app.app_context(): # Creates tables if they don't exist
-    db.create_all()
+webhook_dispatcher.init_app(app)
+
+database_ready = False
+database_lock = threading.Lock()
+
+def ensure_database():
+    """Creates tables if they don't exist. Runs once per process."""
+    global database_ready
+    if database_ready:
+        return
+    with database_lock:
+        if not database_ready:
+            started = time.perf_counter()
+            with app.app_context():
+                db.create_all()
+            database_ready = True
+            startup_metrics['schema_check_seconds'] = round(time.perf_counter() - started, 3)
+            # Deliveries left in the outbox by a previous run are resumed once the tables exist.
+            webhook_dispatcher.start()
 
 # Graceful shutdown handler
 def graceful_shutdown(signum, frame):
     """Ensures the browser is closed cleanly on app termination."""
-    logging.info("Shutdown signal received. Closing browser instance...")
-    with browser_lock:
-        if browser_instance:
-            try:
-                browser_instance.quit()
-                logging.info("Browser instance closed successfully.")
-            except Exception as e:
-                logging.error(f"Error during browser cleanup: {e}")
+    logging.info("Shutdown signal received. Closing browser instances...")
+    try:
+        closed = close_all_browsers()
+        logging.info(f"Closed {closed} browser instance(s) successfully.")
+    except Exception as e:
+        logging.error(f"Error during browser cleanup: {e}")
     exit(0)
 
-signal.signal(signal.SIGINT, graceful_shutdown)
-signal.signal(signal.SIGTERM, graceful_shutdown)
+def install_signal_handlers():
+    signal.signal(signal.SIGINT, graceful_shutdown)
+    signal.signal(signal.SIGTERM, graceful_shutdown)
+
+def warm_up():
+    """Runs the deferred startup work: schema check, browser initialization, hub checks and keep-warm."""
+    started = time.perf_counter()
+    ensure_database()
+    ensure_browser_initialization_started()
+    hub_router.start()
+    start_keep_warm()
+    startup_metrics.setdefault('warmup_seconds', round(time.perf_counter() - started, 3))
+
+if STARTUP_MODE == 'eager':
+    ensure_database()
+    install_signal_handlers()
+    # Start browser initialization in a background thread
+    start_browser_initialization_thread()
+    hub_router.start()
+    start_keep_warm()
+else:
+    @app.before_request
+    def lazy_startup():
+        """Performs the deferred startup work on first use."""
+        ensure_database()
+        if request.blueprint == notebooklm_bp.name:
+            ensure_browser_initialization_started()
+            hub_router.start()
+            start_keep_warm()
 
-# Start browser initialization in a background thread
-start_browser_initialization_thread()
+@app.route('/api/warmup', methods=['GET', 'POST'])
+@app.route('/_ah/warmup', methods=['GET'])
+def warmup():
+    """Warm-up hook for startup probes: performs deferred startup work ahead of real traffic."""
+    warm_up()
+    return jsonify({'success': True, **get_startup_metrics()})
+
+@app.route('/api/startup_metrics', methods=['GET'])
+def startup_metrics_endpoint():
+    """Reports import and startup timings so cold-start latency can be tracked."""
+    return jsonify(get_startup_metrics())
+
+def get_startup_metrics():
+    return {**startup_metrics, **notebooklm.browser_startup_metrics}
 
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
@@ -67,7 +172,12 @@ def serve(path):
         return send_from_directory(static_folder_path, 'index.html')
 
 
+startup_metrics['import_seconds'] = round(time.perf_counter() - _import_started, 3)
+logging.info(f"App imported in {startup_metrics['import_seconds']} seconds (startup mode: {STARTUP_MODE}).")
+
 if __name__ == '__main__':
+    if STARTUP_MODE == 'lazy':
+        install_signal_handlers()
     # Use the PORT environment variable if it's set, otherwise default to 5000
     port = int(os.environ.get('PORT', 5000))
     # The debug flag should be False in a production environment
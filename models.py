@@ -1,3 +1,4 @@
+import time
 from flask_sqlalchemy import SQLAlchemy
 
 db = SQLAlchemy()
@@ -17,3 +18,38 @@ class User(db.Model):
             'username': self.username,
             'email': self.email
         }
+
+class WebhookDelivery(db.Model):
+    """A query result waiting to be (or already) POSTed to a caller's callback URL."""
+    id = db.Column(db.Integer, primary_key=True)
+    callback_url = db.Column(db.String(2048), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    # Results of deliveries marked for batching are sent together with others for the same URL.
+    batch = db.Column(db.Boolean, nullable=False, default=False)
+    status = db.Column(db.String(16), nullable=False, default='pending', index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.Float, nullable=False)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.Float, nullable=False)
+    delivered_at = db.Column(db.Float)
+
+    def __init__(self, callback_url: str, payload: str, batch: bool = False):
+        self.callback_url = callback_url
+        self.payload = payload
+        self.batch = batch
+        self.status = 'pending'
+        self.attempts = 0
+        self.created_at = self.next_attempt_at = time.time()
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'callback_url': self.callback_url,
+            'batch': self.batch,
+            'status': self.status,
+            'attempts': self.attempts,
+            'next_attempt_at': self.next_attempt_at,
+            'last_error': self.last_error,
+            'created_at': self.created_at,
+            'delivered_at': self.delivered_at
+        }
@@ -1,16 +1,24 @@
 from flask import Blueprint, jsonify, request, send_file
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
-from selenium.common.exceptions import TimeoutException, NoSuchElementException
+from urllib.parse import urlsplit
+from latency import LatencyTracker, LENGTH_BUCKETS, LONG_BUCKET
+from hubs import HubRouter
+from similarity import QueryCache, normalize
+from screenshots import IMAGE_FORMATS, ScreenshotCache, encode_screenshot, encoding_available
+from keepwarm import KeepWarmPlanner, KeepWarmScheduler, parse_schedule
+from webhooks import callback_url_error, webhook_dispatcher
+from responses import parse_fields, project_fields
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from tracing import tracer
+import importlib
 import time
 import threading
 import logging
 import os
 import io
+import select
+import socket
+import uuid
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -20,67 +28,328 @@ notebooklm_bp = Blueprint('notebooklm', __name__)
 
 # --- Constants for Selenium Selectors ---
 # Using constants makes the code cleaner and easier to update if the UI changes.
+# Selenium itself is imported on first use, so the locator strategies mirror the
+# values of selenium.webdriver.common.by.By instead of importing it here.
+CSS_SELECTOR = 'css selector'
+XPATH = 'xpath'
 
 # Elements for checking if NotebookLM has loaded
 NOTEBOOKLM_LOAD_INDICATORS = [
-    (By.CSS_SELECTOR, '[data-testid="chat-input"]'),
-    (By.CSS_SELECTOR, 'textarea[placeholder*="Ask"]'),
-    (By.CSS_SELECTOR, '.chat-input'),
-    (By.XPATH, "//textarea[contains(@placeholder, 'Ask')]")
+    (CSS_SELECTOR, '[data-testid="chat-input"]'),
+    (CSS_SELECTOR, 'textarea[placeholder*="Ask"]'),
+    (CSS_SELECTOR, '.chat-input'),
+    (XPATH, "//textarea[contains(@placeholder, 'Ask')]")
 ]
 
 # Elements for the chat input field
 CHAT_INPUT_SELECTORS = [
-    (By.CSS_SELECTOR, '[data-testid="chat-input"]'),
-    (By.CSS_SELECTOR, 'textarea[placeholder*="Ask"]'),
-    (By.CSS_SELECTOR, '.chat-input textarea'),
-    (By.CSS_SELECTOR, 'textarea[aria-label*="Ask"]')
+    (CSS_SELECTOR, '[data-testid="chat-input"]'),
+    (CSS_SELECTOR, 'textarea[placeholder*="Ask"]'),
+    (CSS_SELECTOR, '.chat-input textarea'),
+    (CSS_SELECTOR, 'textarea[aria-label*="Ask"]')
 ]
 
 # Elements for the submit button
 SUBMIT_BUTTON_SELECTORS = [
-    (By.CSS_SELECTOR, 'button[data-testid="send-button"]'),
-    (By.CSS_SELECTOR, 'button[aria-label*="Send"]')
+    (CSS_SELECTOR, 'button[data-testid="send-button"]'),
+    (CSS_SELECTOR, 'button[aria-label*="Send"]')
 ]
 
-RESPONSE_CONTENT_SELECTOR = (By.CSS_SELECTOR, '.message-content')
+# Elements for stopping a response that is still being generated
+STOP_GENERATION_SELECTORS = [
+    (CSS_SELECTOR, 'button[data-testid="stop-button"]'),
+    (CSS_SELECTOR, 'button[aria-label*="Stop"]')
+]
+
+RESPONSE_CONTENT_SELECTOR = (CSS_SELECTOR, '.message-content')
+
+# Page areas that /screenshot can capture on their own with ?element=<name>
+SCREENSHOT_ELEMENT_SELECTORS = {
+    'chat': [
+        (CSS_SELECTOR, '[data-testid="chat-panel"]'),
+        (CSS_SELECTOR, '.chat-panel'),
+        (CSS_SELECTOR, 'section[aria-label*="Chat"]')
+    ],
+    'sources': [
+        (CSS_SELECTOR, '[data-testid="source-panel"]'),
+        (CSS_SELECTOR, '.source-panel'),
+        (CSS_SELECTOR, 'section[aria-label*="Sources"]')
+    ],
+    'input': CHAT_INPUT_SELECTORS
+}
+
+# Non-standard status (as used by nginx) for requests the client abandoned.
+CLIENT_CLOSED_REQUEST = 499
+
+# --- Query Deadlines ---
+DEFAULT_QUERY_TIMEOUT = 120
+# 'fixed' uses the caller's timeout as-is; 'adaptive' derives it from past answer times.
+QUERY_TIMEOUT_MODE = os.environ.get('QUERY_TIMEOUT_MODE', 'fixed')
+ADAPTIVE_TIMEOUT_PERCENTILE = float(os.environ.get('ADAPTIVE_TIMEOUT_PERCENTILE', 95))
+ADAPTIVE_TIMEOUT_MARGIN = float(os.environ.get('ADAPTIVE_TIMEOUT_MARGIN', 1.5))
+ADAPTIVE_TIMEOUT_MIN = int(os.environ.get('ADAPTIVE_TIMEOUT_MIN', 15))
+ADAPTIVE_TIMEOUT_MAX = int(os.environ.get('ADAPTIVE_TIMEOUT_MAX', 300))
+# Return the partial answer once it has stopped growing for this many seconds (0 disables).
+QUERY_STALL_TIMEOUT = float(os.environ.get('QUERY_STALL_TIMEOUT', 0))
+
+# --- Selenium Hubs ---
+# A comma-separated SELENIUM_HUB_URLS shards notebooks across several hubs with consistent
+# hashing. SELENIUM_HUB_URL is used when only a single hub is configured.
+SELENIUM_HUB_URLS = [
+    hub_url.strip()
+    for hub_url in os.environ.get('SELENIUM_HUB_URLS', os.environ.get('SELENIUM_HUB_URL', 'http://localhost:4444/wd/hub')).split(',')
+    if hub_url.strip()
+]
+HUB_HEALTH_CHECK_INTERVAL = int(os.environ.get('HUB_HEALTH_CHECK_INTERVAL', 30))
+
+# --- Driver Backend ---
+# 'hub' drives Chrome through the Selenium hubs above. 'local' starts chromedriver directly
+# when Chrome runs next to the app, which saves the hub and node hops on every command.
+DRIVER_BACKEND = os.environ.get('DRIVER_BACKEND', 'hub')
+if DRIVER_BACKEND not in ('hub', 'local'):
+    logger.warning(f"Unknown DRIVER_BACKEND '{DRIVER_BACKEND}', falling back to 'hub'.")
+    DRIVER_BACKEND = 'hub'
+# Path to chromedriver for the local backend. When unset, Selenium Manager locates or downloads it.
+CHROMEDRIVER_PATH = os.environ.get('CHROMEDRIVER_PATH')
+CHROME_HEADLESS = os.environ.get('CHROME_HEADLESS', 'false').lower() == 'true'
+# Kept-alive HTTP connections per driver, so concurrent commands (e.g. screenshots) do not reconnect.
+WEBDRIVER_CONNECTION_POOL_SIZE = int(os.environ.get('WEBDRIVER_CONNECTION_POOL_SIZE', 4))
+# Session name used in place of a hub URL by the local backend.
+LOCAL_DRIVER = 'local'
+
+# --- Answer Cache ---
+# Answers are reused for later queries to the same notebook whose TF-IDF cosine similarity
+# to an answered query is at least SIMILARITY_THRESHOLD (1.0 only reuses exact repeats).
+SIMILARITY_CACHE_ENABLED = os.environ.get('SIMILARITY_CACHE_ENABLED', 'true').lower() == 'true'
+SIMILARITY_THRESHOLD = float(os.environ.get('SIMILARITY_THRESHOLD', 0.85))
+SIMILARITY_CACHE_MAX_ENTRIES = int(os.environ.get('SIMILARITY_CACHE_MAX_ENTRIES', 50000))
+
+# --- Screenshots ---
+# Screenshots are reused for this many seconds, so polling dashboards do not reach the browser.
+SCREENSHOT_CACHE_TTL = float(os.environ.get('SCREENSHOT_CACHE_TTL', 2))
+DEFAULT_SCREENSHOT_QUALITY = 80
+
+# --- Keep-Warm ---
+# A background pass every KEEPWARM_INTERVAL seconds touches notebook pages idle for
+# KEEPWARM_IDLE_SECONDS, reloads pages open for KEEPWARM_REFRESH_SECONDS before their
+# sign-in state expires, and re-opens KEEPWARM_PINNED_NOTEBOOKS KEEPWARM_LEAD_SECONDS before
+# each KEEPWARM_SCHEDULE time (comma-separated HH:MM, local time). Busy browsers are skipped.
+KEEPWARM_ENABLED = os.environ.get('KEEPWARM_ENABLED', 'false').lower() == 'true'
+KEEPWARM_INTERVAL = int(os.environ.get('KEEPWARM_INTERVAL', 60))
+KEEPWARM_IDLE_SECONDS = int(os.environ.get('KEEPWARM_IDLE_SECONDS', 300))
+KEEPWARM_REFRESH_SECONDS = int(os.environ.get('KEEPWARM_REFRESH_SECONDS', 2700))
+KEEPWARM_PINNED_NOTEBOOKS = [
+    notebook_url.strip()
+    for notebook_url in os.environ.get('KEEPWARM_PINNED_NOTEBOOKS', '').split(',')
+    if notebook_url.strip()
+]
+try:
+    KEEPWARM_SCHEDULE = parse_schedule(os.environ.get('KEEPWARM_SCHEDULE', ''))
+except ValueError as e:
+    logger.warning(f"{e} in KEEPWARM_SCHEDULE, ignoring the schedule.")
+    KEEPWARM_SCHEDULE = []
+KEEPWARM_LEAD_SECONDS = int(os.environ.get('KEEPWARM_LEAD_SECONDS', 300))
+
+# Queries answered by callback run on a fixed pool of threads. Up to CALLBACK_QUERY_QUEUE_SIZE more
+# wait for a thread; beyond that new callback queries are refused with 503.
+CALLBACK_QUERY_WORKERS = int(os.environ.get('CALLBACK_QUERY_WORKERS', 4))
+CALLBACK_QUERY_QUEUE_SIZE = int(os.environ.get('CALLBACK_QUERY_QUEUE_SIZE', 32))
+callback_query_executor = ThreadPoolExecutor(max_workers=CALLBACK_QUERY_WORKERS, thread_name_prefix='callback-query')
+callback_query_slots = threading.BoundedSemaphore(CALLBACK_QUERY_WORKERS + CALLBACK_QUERY_QUEUE_SIZE)
+
+class BrowserSession:
+    """
+    The browser running on one Selenium hub. Each session has its own lock, so queries
+    for notebooks that live on different hubs run in parallel.
+    """
+
+    def __init__(self, hub_url):
+        self.hub_url = hub_url
+        self.driver = None
+        self.lock = threading.Lock()
+        self.initialization_thread = None
+        # Set once the browser has been requested, so lazy startup only triggers initialization once.
+        # Cleared again when every attempt fails, so a hub that comes back can get a browser.
+        self.initialization_requested = False
+        self.notebook_url = None
+        # Monotonic times of the last use of the browser and of the last notebook page load.
+        self.last_activity = time.monotonic()
+        self.page_loaded_at = None
+        self.authentication_required = False
+
+    def to_dict(self):
+        return {
+            'hub_url': self.hub_url,
+            'browser_active': self.driver is not None,
+            'notebook_url': self.notebook_url,
+            'idle_seconds': round(time.monotonic() - self.last_activity, 1),
+            'authentication_required': self.authentication_required
+        }
+
+hub_router = HubRouter([LOCAL_DRIVER] if DRIVER_BACKEND == 'local' else SELENIUM_HUB_URLS,
+                       check_interval=HUB_HEALTH_CHECK_INTERVAL)
+browser_sessions = {hub_url: BrowserSession(hub_url) for hub_url in hub_router.ring.hub_urls}
+# Session used by requests that do not name a notebook: the one that most recently opened a notebook.
+default_session = browser_sessions[hub_router.primary]
+
+# Timings for the (deferred) Selenium import and browser startup, reported by main.py.
+browser_startup_metrics = {}
+
+# Queries that are currently waiting for or using the browser, keyed by query id.
+active_queries = {}
+active_queries_lock = threading.Lock()
+
+# Answer time distributions used to pick adaptive deadlines.
+latency_tracker = LatencyTracker()
+
+# Answers of completed queries, per notebook, for near-duplicate lookups.
+query_cache = QueryCache(SIMILARITY_THRESHOLD, SIMILARITY_CACHE_MAX_ENTRIES)
+
+# Recent screenshots per browser and capture options.
+screenshot_cache = ScreenshotCache(SCREENSHOT_CACHE_TTL)
+
+keep_warm_planner = KeepWarmPlanner(KEEPWARM_IDLE_SECONDS, KEEPWARM_REFRESH_SECONDS, KEEPWARM_SCHEDULE, KEEPWARM_LEAD_SECONDS)
+
+class QueryCancelled(Exception):
+    """Raised inside a running query once it has been cancelled."""
 
-# Global variable to store the browser instance
-browser_instance = None
-browser_lock = threading.Lock()
-initialization_thread = None
+class ActiveQuery:
+    """
+    Tracks a single in-flight query so that it can be cancelled, either through
+    the API or automatically when the requesting client disconnects.
+    """
+
+    def __init__(self, query_id, environ=None):
+        self.query_id = query_id
+        self.hub_url = None
+        self.environ = environ or {}
+        self.started_at = time.time()
+        self.cancel_reason = None
+        self._cancel_event = threading.Event()
+
+    def cancel(self, reason):
+        if not self._cancel_event.is_set():
+            self.cancel_reason = reason
+            self._cancel_event.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def raise_if_cancelled(self):
+        """Raises QueryCancelled if the query was cancelled or its client went away."""
+        if not self.cancelled and _client_disconnected(self.environ):
+            logger.info(f"Client for query {self.query_id} disconnected. Cancelling.")
+            self.cancel('client_disconnected')
+        if self.cancelled:
+            raise QueryCancelled(self.cancel_reason)
+
+    def to_dict(self):
+        return {
+            'query_id': self.query_id,
+            'hub_url': self.hub_url,
+            'elapsed_seconds': round(time.time() - self.started_at, 2),
+            'status': 'cancelling' if self.cancelled else 'running'
+        }
+
+def _client_disconnected(environ):
+    """
+    Best-effort check for whether the HTTP client has hung up.
+    Only the Werkzeug server exposes the connection socket; for other servers this returns False.
+    """
+    sock = environ.get('werkzeug.socket')
+    if sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        # A readable socket with nothing to read means the peer closed the connection.
+        return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b''
+    except ValueError:
+        # Raised for closed or TLS-wrapped sockets, where peeking is not supported.
+        return False
+    except OSError:
+        return True
+
+def _register_query(query_id, environ):
+    """Registers a new in-flight query. Returns None if the id is already in use."""
+    with active_queries_lock:
+        if query_id in active_queries:
+            return None
+        active_query = ActiveQuery(query_id, environ)
+        active_queries[query_id] = active_query
+        return active_query
+
+def _unregister_query(query_id):
+    with active_queries_lock:
+        active_queries.pop(query_id, None)
 
-def start_browser_initialization_thread():
+def get_session(notebooklm_url=None):
+    """
+    Returns the browser session for a notebook, routed to its hub by consistent hashing,
+    or the default session when no notebook is given.
+    """
+    if notebooklm_url:
+        return browser_sessions[hub_router.route(_notebook_key(notebooklm_url))]
+    return default_session
+
+def start_browser_initialization_thread(session=None):
     """
     Starts the browser initialization in a background thread if not already running.
+    Without a session, a browser is started on every configured hub.
     This function is thread-safe.
     """
-    global initialization_thread
-    with browser_lock:
-        if not (initialization_thread and initialization_thread.is_alive()):
-            logger.info("Starting new browser initialization thread.")
-            initialization_thread = threading.Thread(target=initialize_browser, daemon=True)
-            initialization_thread.start()
+    for session in ([session] if session else list(browser_sessions.values())):
+        with session.lock:
+            if not (session.initialization_thread and session.initialization_thread.is_alive()):
+                session.initialization_requested = True
+                logger.info(f"Starting new browser initialization thread for {session.hub_url}.")
+                session.initialization_thread = threading.Thread(target=initialize_browser, args=(session,), daemon=True)
+                session.initialization_thread.start()
 
-def initialize_browser(max_retries=3, retry_delay=15):
+def ensure_browser_initialization_started(session=None):
+    """
+    Starts browser initialization on first use. Used by the lazy startup mode, where
+    the browser is not created when the app is imported, and for hubs taking over
+    notebooks from a failed hub.
+    """
+    for session in ([session] if session else list(browser_sessions.values())):
+        if session.driver is None and not session.initialization_requested:
+            start_browser_initialization_thread(session)
+
+def import_selenium():
+    """
+    Imports the Selenium modules used to start a browser. The first call pays for the
+    import, which is recorded as selenium_import_seconds; later calls hit the module cache.
     """
-    Initializes the browser instance in the background with retries.
+    import_started = time.perf_counter()
+    for module in ('selenium.webdriver', 'selenium.webdriver.chrome.options',
+                   'selenium.webdriver.support.expected_conditions', 'selenium.webdriver.support.ui'):
+        importlib.import_module(module)
+    browser_startup_metrics.setdefault('selenium_import_seconds', round(time.perf_counter() - import_started, 3))
+
+def initialize_browser(session, max_retries=3, retry_delay=15):
+    """
+    Initializes the browser for a session in the background with retries.
     This function is intended to be run in a separate thread on app startup.
     """
-    global browser_instance
+    import_selenium()
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+
+    started = time.perf_counter()
     url = os.environ.get('NOTEBOOKLM_BASE_URL', 'https://notebooklm.google.com/')
 
     for attempt in range(max_retries):
-        logger.info(f"Browser initialization attempt {attempt + 1}/{max_retries}...")
+        logger.info(f"Browser initialization attempt {attempt + 1}/{max_retries} on {session.hub_url}...")
         try:
             # Lock to prevent race conditions
-            with browser_lock:
-                if browser_instance:
+            with session.lock:
+                if session.driver:
                     logger.info("Browser is already initialized. Skipping.")
                     return
 
             # Create driver outside the lock
-            driver = create_undetected_driver()
+            driver = create_undetected_driver(session.hub_url)
             logger.info(f"Driver created. Navigating to initial URL: {url}")
             driver.get(url)
 
@@ -98,24 +367,53 @@ def initialize_browser(max_retries=3, retry_delay=15):
             else:
                 logger.info("Initial page loaded successfully. Browser is ready.")
 
-            # Acquire lock again to set the global instance
-            with browser_lock:
-                browser_instance = driver
+            # Acquire lock again to set the session's driver
+            with session.lock:
+                session.driver = driver
+            hub_router.mark_healthy(session.hub_url)
+            browser_startup_metrics.setdefault('browser_ready_seconds', round(time.perf_counter() - started, 3))
 
             logger.info("Browser initialization successful.")
             return  # Exit the loop on success
 
         except Exception as e:
-            logger.error(f"Attempt {attempt + 1} failed to initialize browser: {e}")
+            logger.error(f"Attempt {attempt + 1} failed to initialize browser on {session.hub_url}: {e}")
+            hub_router.mark_failed(session.hub_url, e)
             if attempt < max_retries - 1:
                 logger.info(f"Retrying in {retry_delay} seconds...")
                 time.sleep(retry_delay)
             else:
                 logger.error("All browser initialization attempts failed.")
+                # Let the next request for this hub start over, e.g. once the hub is back.
+                with session.lock:
+                    session.initialization_requested = False
 
+def close_all_browsers():
+    """Quits the browser of every session. Returns the number of browsers closed."""
+    closed = 0
+    for session in browser_sessions.values():
+        with session.lock:
+            if session.driver:
+                logger.info(f"Closing browser instance on {session.hub_url}")
+                try:
+                    session.driver.quit()
+                    closed += 1
+                finally:
+                    session.driver = None
+                    session.notebook_url = None
+    return closed
+
+
+def create_undetected_driver(selenium_hub_url=None):
+    """
+    Create a Chrome driver with options to bypass automation detection.
+    Connects to the given Selenium hub, or starts a local chromedriver for LOCAL_DRIVER
+    (the default with DRIVER_BACKEND=local). Both keep their HTTP connections alive.
+    """
+    import_selenium()
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
 
-def create_undetected_driver():
-    """Create a Chrome driver with options to bypass automation detection"""
     chrome_options = Options()
 
     # Use a persistent user profile, configurable via environment variable. This is crucial for staying logged in.
@@ -139,14 +437,37 @@ def create_undetected_driver():
     default_user_agent = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/138.0.7204.157 Safari/537.36'
     user_agent = os.environ.get('CHROME_USER_AGENT', default_user_agent)
     chrome_options.add_argument(f'user-agent={user_agent}')
+    if CHROME_HEADLESS:
+        chrome_options.add_argument('--headless=new')
 
-    # Connect to remote Selenium server. Default to localhost for local development.
-    selenium_hub_url = os.environ.get('SELENIUM_HUB_URL', 'http://localhost:4444/wd/hub')
-    logger.info(f"Connecting to Selenium Hub at: {selenium_hub_url}")
-    driver = webdriver.Remote(
-        command_executor=selenium_hub_url,
-        options=chrome_options
-    )
+    selenium_hub_url = selenium_hub_url or hub_router.primary
+    if selenium_hub_url == LOCAL_DRIVER:
+        from selenium.webdriver.chrome.service import Service
+
+        logger.info(f"Starting local chromedriver ({CHROMEDRIVER_PATH or 'located by Selenium Manager'}).")
+        driver = webdriver.Chrome(
+            options=chrome_options,
+            service=Service(executable_path=CHROMEDRIVER_PATH),
+            keep_alive=True
+        )
+    else:
+        from selenium.webdriver.remote.client_config import ClientConfig
+
+        # Connect to remote Selenium server, reusing pooled keep-alive connections to the hub.
+        logger.info(f"Connecting to Selenium Hub at: {selenium_hub_url}")
+        client_config = ClientConfig(
+            remote_server_addr=selenium_hub_url,
+            keep_alive=True,
+            init_args_for_pool_manager={'init_args_for_pool_manager': {'maxsize': WEBDRIVER_CONNECTION_POOL_SIZE}}
+        )
+        driver = webdriver.Remote(
+            command_executor=selenium_hub_url,
+            options=chrome_options,
+            client_config=client_config
+        )
+
+    # Record every WebDriver command as a span of the current request's trace.
+    tracer.instrument_driver(driver)
 
     # Set a page load timeout to avoid hangs
     driver.set_page_load_timeout(60)
@@ -155,7 +476,7 @@ def create_undetected_driver():
     # driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
     return driver
 
-def find_element_by_priority(driver, selectors, condition=EC.presence_of_element_located, timeout=10):
+def find_element_by_priority(driver, selectors, condition=None, timeout=10):
     """
     Tries to find an element by iterating through a list of selectors.
     Returns the first element that matches any selector and the expected condition.
@@ -163,9 +484,15 @@ def find_element_by_priority(driver, selectors, condition=EC.presence_of_element
     :param driver: The Selenium WebDriver instance.
     :param selectors: A list of tuples, where each tuple is (By, value).
     :param condition: An expected condition from selenium.webdriver.support.expected_conditions.
+                      Defaults to presence_of_element_located.
     :param timeout: The maximum time to wait for the element.
     :return: The WebElement if found, otherwise None.
     """
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.common.exceptions import TimeoutException
+
+    condition = condition or EC.presence_of_element_located
     wait = WebDriverWait(driver, timeout)
     for by, value in selectors:
         try:
@@ -175,45 +502,160 @@ def find_element_by_priority(driver, selectors, condition=EC.presence_of_element
             continue
     return None
 
+def _is_sign_in_page(url):
+    return 'accounts.google.com' in url or 'signin' in url.lower()
+
+def _load_notebook_page(session, url):
+    """Navigates the session's browser to a notebook and records when and whether it loaded signed in."""
+    session.driver.get(url)
+    session.notebook_url = url
+    session.page_loaded_at = session.last_activity = time.monotonic()
+    session.authentication_required = _is_sign_in_page(session.driver.current_url)
+
+# Fetches the notebook page with the browser's cookies, so the Google session and NotebookLM see
+# real traffic without the page being reloaded. A signed-out session is redirected to the sign-in
+# page, which shows up as an opaque redirect as redirects are not followed.
+KEEPWARM_TOUCH_SCRIPT = """
+const done = arguments[arguments.length - 1];
+fetch(arguments[0], {credentials: 'include', cache: 'no-store', redirect: 'manual'})
+    .then(response => done({status: response.status, redirected: response.type === 'opaqueredirect'}))
+    .catch(error => done({error: String(error)}));
+"""
+
+def _touch_notebook_page(session):
+    """Requests the session's notebook in the background and records whether it is still signed in."""
+    result = session.driver.execute_async_script(KEEPWARM_TOUCH_SCRIPT, session.notebook_url)
+    if not result or result.get('error'):
+        raise RuntimeError(f"Touch request failed: {(result or {}).get('error')}")
+    session.authentication_required = result['redirected']
+
+def _session_busy(session):
+    """Whether a query is running on, or waiting for, the session's browser."""
+    with active_queries_lock:
+        # Queries that have not picked a session yet count as busy for every session.
+        return any(active_query.hub_url in (None, session.hub_url) for active_query in active_queries.values())
+
+def keep_warm_pass():
+    """
+    Runs one keep-warm pass over all sessions and returns the actions taken as
+    (hub url, action) tuples. A session is only used if no query is running or waiting
+    for it and its lock is free, so keep-warm never delays a live query.
+    """
+    slot = keep_warm_planner.pinned_slot(datetime.now()) if KEEPWARM_PINNED_NOTEBOOKS else None
+    actions = []
+    for session in list(browser_sessions.values()):
+        pinned = [
+            notebook_url for notebook_url in KEEPWARM_PINNED_NOTEBOOKS
+            if slot and get_session(notebook_url) is session
+            and not keep_warm_planner.is_warmed(_notebook_key(notebook_url), slot)
+        ]
+        if session.driver is None:
+            if pinned:
+                ensure_browser_initialization_started(session)
+            continue
+        if _session_busy(session) or not session.lock.acquire(blocking=False):
+            continue
+        try:
+            # A query may have arrived while the lock was being taken; leave the browser to it.
+            action = None if _session_busy(session) else _keep_warm_session(session, pinned, slot)
+        finally:
+            session.lock.release()
+        if action:
+            actions.append((session.hub_url, action))
+    return actions
+
+def _keep_warm_session(session, pinned, slot):
+    """
+    Touches, refreshes or re-opens a pinned notebook in a session whose lock is held.
+    A pinned notebook is only opened in a browser that has no notebook open or already shows
+    it, so keep-warm never replaces the notebook a client opened with /open_notebooklm.
+    """
+    now = time.monotonic()
+    action = None
+    try:
+        pinned_url = next((url for url in pinned if session.notebook_url in (None, url)), None)
+        for url in pinned:
+            if url != pinned_url:
+                logger.info(f"Keep-warm skips pinned notebook {url}: the browser on {session.hub_url} "
+                            f"is showing another notebook.")
+                keep_warm_planner.mark_warmed(_notebook_key(url), slot)
+        if pinned_url:
+            # One navigation per pass, so the browser is free again quickly.
+            _load_notebook_page(session, pinned_url)
+            keep_warm_planner.mark_warmed(_notebook_key(pinned_url), slot)
+            action = 'open_pinned'
+        elif session.notebook_url:
+            page_age = now - session.page_loaded_at if session.page_loaded_at is not None else None
+            action = keep_warm_planner.session_action(now - session.last_activity, page_age)
+            if action == 'refresh':
+                _load_notebook_page(session, session.notebook_url)
+            elif action == 'touch':
+                _touch_notebook_page(session)
+                session.last_activity = now
+    except Exception as e:
+        logger.warning(f"Keep-warm failed on {session.hub_url}: {e}")
+        return None
+    if action:
+        logger.info(f"Keep-warm {action} on {session.hub_url}.")
+        if session.authentication_required:
+            logger.warning(f"Browser on {session.hub_url} is signed out. Manual login via VNC is required.")
+    return action
+
+keep_warm = KeepWarmScheduler(keep_warm_pass, KEEPWARM_INTERVAL)
+
+def start_keep_warm():
+    """Starts the keep-warm scheduler if it is enabled. Safe to call more than once."""
+    if KEEPWARM_ENABLED:
+        keep_warm.start()
+
 @notebooklm_bp.route('/open_notebooklm', methods=['POST'])
 def open_notebooklm():
     """
     Endpoint 1: Opens a specific NotebookLM in headless Chrome browser
     Expects JSON: {"notebooklm_url": "https://notebooklm.google.com/notebook/..."}
+    The notebook is opened in the browser on the Selenium hub it is routed to.
     """
-    global browser_instance
+    global default_session
 
     data = request.get_json()
     if not data or 'notebooklm_url' not in data:
         return jsonify({'error': 'notebooklm_url is required'}), 400
 
     notebooklm_url = data['notebooklm_url']
-    logger.info(f"Attempting to open NotebookLM URL: {notebooklm_url}")
+    session = get_session(notebooklm_url)
+    logger.info(f"Attempting to open NotebookLM URL: {notebooklm_url} on hub {session.hub_url}")
+    ensure_browser_initialization_started(session)
 
-    with browser_lock:
-        if not browser_instance:
+    with session.lock:
+        if not session.driver:
             logger.error("Browser is not initialized. The background initialization may have failed.")
             return jsonify({
                 'error': 'Browser not initialized. Check service logs for errors.',
+                'hub_url': session.hub_url,
                 'status': 'not_initialized'
             }), 503  # Service Unavailable
 
+        default_session = session
         # Core browser interaction logic
-        return _perform_open_notebook(notebooklm_url)
+        return _perform_open_notebook(session, notebooklm_url)
 
-def _perform_open_notebook(url):
+def _perform_open_notebook(session, url):
     """Helper function to contain the browser navigation and validation logic."""
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.common.exceptions import TimeoutException
+
+    browser_instance = session.driver
     assert browser_instance is not None, "Browser instance must be initialized before calling this function."
     try:
         # Navigate to the NotebookLM URL
-        browser_instance.get(url)
+        _load_notebook_page(session, url)
 
         # Wait for page to load and check if we're on the correct page
         wait = WebDriverWait(browser_instance, 30)
 
         # Check if we're redirected to Google sign-in page
         current_url = browser_instance.current_url
-        if 'accounts.google.com' in current_url or 'signin' in current_url.lower():
+        if session.authentication_required:
             logger.warning("Redirected to Google sign-in page")
             return jsonify({
                 'error': 'Redirected to Google sign-in page. Authentication required. Please log in using VNC.',
@@ -231,6 +673,7 @@ def _perform_open_notebook(url):
             'success': True,
             'message': 'NotebookLM opened successfully',
             'current_url': browser_instance.current_url,
+            'hub_url': session.hub_url
         })
     except TimeoutException:
         logger.warning("NotebookLM interface not detected, but page loaded")
@@ -238,6 +681,7 @@ def _perform_open_notebook(url):
             'success': True,
             'message': 'Page loaded but NotebookLM interface not fully detected',
             'current_url': browser_instance.current_url,
+            'hub_url': session.hub_url,
             'status': 'partial_load'
         })
     except Exception as e:
@@ -249,32 +693,305 @@ def query_notebooklm():
     """
     Endpoint 2: Queries NotebookLM and waits for complete response
     Expects JSON: {"query": "Your question here"}
+    An optional "query_id" can be supplied so the query can be cancelled with
+    DELETE /api/queries/<query_id> while it is still running.
+    Optional deadline settings: "timeout_mode" ("fixed" or "adaptive"), "expected_length"
+    ("short", "medium" or "long") and "stall_timeout" (seconds without the answer growing
+    before the partial answer is returned).
+    An optional "notebooklm_url" routes the query to that notebook's hub and opens it if needed.
+    Answers to earlier, similar queries for the same notebook are returned from the cache
+    (marked with a "cache" object) unless "use_cache" is false, which forces a fresh answer
+    that is then cached. "similarity_threshold" overrides the configured minimum similarity.
+    With a "callback_url" the query runs in the background and 202 is returned straight away;
+    the result is POSTed to the URL once it is ready. With "callback_batch": true it may be
+    sent together with other results for the same URL, as {"results": [...]}.
+    An optional "fields" (a list, or comma-separated in the body or query string) limits
+    successful results to those fields, e.g. "response_content,query_id".
     """
-    global browser_instance
-    
-    if not browser_instance:
-        return jsonify({'error': 'Browser not initialized. Call /open_notebooklm first.'}), 400
-    
     data = request.get_json()
     if not data or 'query' not in data:
         return jsonify({'error': 'query is required'}), 400
+
+    notebooklm_url = data.get('notebooklm_url')
+    session = get_session(notebooklm_url)
     
     query = data.get('query')
+    timeout_mode = data.get('timeout_mode', QUERY_TIMEOUT_MODE)
+    if timeout_mode not in ('fixed', 'adaptive'):
+        return jsonify({'error': "timeout_mode must be 'fixed' or 'adaptive'"}), 400
+    length_buckets = [name for _, name in LENGTH_BUCKETS] + [LONG_BUCKET]
+    expected_length = data.get('expected_length')
+    if expected_length is not None and expected_length not in length_buckets:
+        return jsonify({'error': f"expected_length must be one of {', '.join(length_buckets)}"}), 400
+    adaptive = timeout_mode == 'adaptive'
     # Allow the user to specify a timeout, with a default of 120 seconds.
-    timeout = int(data.get('timeout', 120))
-    logger.info(f"Submitting query: '{query}' with a timeout of {timeout} seconds.")
-    
+    # In adaptive mode the timeout is an upper bound for the derived deadline.
+    timeout = int(data.get('timeout', ADAPTIVE_TIMEOUT_MAX if adaptive else DEFAULT_QUERY_TIMEOUT))
+    try:
+        stall_timeout = float(data.get('stall_timeout', QUERY_STALL_TIMEOUT))
+    except (TypeError, ValueError):
+        stall_timeout = -1
+    if not stall_timeout >= 0:
+        return jsonify({'error': 'stall_timeout must be a number of seconds, 0 or more'}), 400
+    query_id = str(data.get('query_id') or uuid.uuid4().hex)
+    similarity_threshold = data.get('similarity_threshold')
+    if similarity_threshold is not None:
+        try:
+            similarity_threshold = float(similarity_threshold)
+        except (TypeError, ValueError):
+            similarity_threshold = 0
+        if not 0 < similarity_threshold <= 1:
+            return jsonify({'error': 'similarity_threshold must be greater than 0 and at most 1'}), 400
+    callback_url = data.get('callback_url')
+    callback_batch = bool(data.get('callback_batch', False))
+    try:
+        fields = parse_fields(data.get('fields', request.args.get('fields')))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    callback_error = callback_url_error(callback_url) if callback_url is not None else None
+    if callback_error:
+        return jsonify({'error': callback_error}), 400
+
+    target_url = notebooklm_url or session.notebook_url
+    cache_notebook = _notebook_key(target_url) if target_url else None
+    if SIMILARITY_CACHE_ENABLED and cache_notebook and data.get('use_cache', True):
+        cached = _cached_answer(cache_notebook, query, similarity_threshold)
+        if cached:
+            cached['query_id'] = query_id
+            if callback_url:
+                delivery_id = _enqueue_callback(callback_url, callback_batch, query_id, project_fields(cached, fields), 200)
+                return jsonify(_accepted_result(query_id, delivery_id)), 202
+            return jsonify(project_fields(cached, fields)), 200
+
+    if not session.driver:
+        return jsonify({'error': 'Browser not initialized. Call /open_notebooklm first.'}), 400
+
+    # A query answered by callback is not tied to the request's connection, so it is not
+    # cancelled when the client disconnects after the 202.
+    active_query = _register_query(query_id, {} if callback_url else request.environ)
+    if not active_query:
+        return jsonify({'error': f"A query with id '{query_id}' is already in progress"}), 409
+
+    # Only the query's length is logged; the query text itself can contain sensitive content.
+    logger.info(f"Submitting query {query_id} (trace {tracer.current_trace_id()}, {len(query)} characters) "
+                f"with a {timeout_mode} timeout of up to {timeout} seconds.")
+
+    def run_query():
+        try:
+            result, status_code = _execute_query(
+                active_query, session, query, timeout, notebooklm_url=notebooklm_url,
+                adaptive=adaptive, expected_length=expected_length, stall_timeout=stall_timeout
+            )
+        finally:
+            _unregister_query(query_id)
+
+        if SIMILARITY_CACHE_ENABLED and cache_notebook and status_code == 200 and result.get('response_content'):
+            query_cache.store(cache_notebook, query, result['response_content'])
+        result['query_id'] = query_id
+        # Errors are always returned in full, so they stay readable whatever fields were asked for.
+        return (project_fields(result, fields) if status_code < 400 else result), status_code
+
+    if callback_url:
+        # The background query continues the request's trace, so the trace id in the 202 response
+        # leads to its lock-wait, submit, wait and WebDriver spans.
+        request_trace = tracer.current_trace
+        if not callback_query_slots.acquire(blocking=False):
+            _unregister_query(query_id)
+            return jsonify({'error': 'Too many callback queries are waiting. Try again shortly.'}), 503, {'Retry-After': '1'}
+
+        def run_query_for_callback():
+            if request_trace:
+                tracer.start_trace(request_trace.trace_id, request_trace.sampled)
+            try:
+                with tracer.span('query.callback', query_id=query_id):
+                    result, status_code = run_query()
+            except Exception as e:
+                logger.error(f"Background query {query_id} failed: {e}", exc_info=True)
+                result, status_code = {'error': f'Failed to query NotebookLM: {str(e)}', 'query_id': query_id}, 500
+            finally:
+                tracer.end_trace()
+            try:
+                _enqueue_callback(callback_url, callback_batch, query_id, result, status_code)
+            finally:
+                callback_query_slots.release()
+
+        callback_query_executor.submit(run_query_for_callback)
+        return jsonify(_accepted_result(query_id)), 202
+
+    result, status_code = run_query()
+    return jsonify(result), status_code
+
+def _enqueue_callback(callback_url, batch, query_id, result, status_code):
+    """Stores a query result in the webhook outbox and returns the delivery id."""
+    # The query id is always sent, whatever fields were asked for, so the receiver can match it up.
+    delivery_id = webhook_dispatcher.enqueue(callback_url, {**result, 'query_id': query_id, 'status_code': status_code}, batch)
+    logger.info(f"Queued webhook delivery {delivery_id} for query {query_id}.")
+    return delivery_id
+
+def _accepted_result(query_id, delivery_id=None):
+    return {
+        'success': True,
+        'message': 'Query accepted. The result will be POSTed to callback_url.',
+        'query_id': query_id,
+        'status': 'accepted',
+        'delivery_id': delivery_id
+    }
+
+def _cached_answer(notebook, query, threshold=None):
+    """Returns a query result built from the cached answer to a similar query, or None."""
+    with tracer.span('query.cache_lookup') as span:
+        match = query_cache.lookup(notebook, query, threshold)
+        if span:
+            span.set_attribute('hit', match is not None)
+    if not match:
+        return None
+    entry, similarity = match
+    exact = normalize(entry.query) == normalize(query)
+    logger.info(f"Answered from cache ({'exact' if exact else 'approximate'} match, similarity {similarity:.3f}).")
+    return {
+        'success': True,
+        'message': 'Query answered from cache' + ('' if exact else ' (approximate match)'),
+        'query': query,
+        'response_content': entry.answer,
+        'content_length': len(entry.answer),
+        'cache': {
+            'match': 'exact' if exact else 'approximate',
+            'similarity': round(similarity, 4),
+            'matched_query': entry.query,
+            'cached_at': entry.cached_at
+        }
+    }
+
+def _acquire_browser_lock(active_query, session, poll_interval=0.5):
+    """
+    Waits for the session's browser lock, checking for cancellation between attempts so
+    that an abandoned query does not stay queued behind the one currently running.
+    """
+    while not session.lock.acquire(timeout=poll_interval):
+        active_query.raise_if_cancelled()
+    try:
+        active_query.raise_if_cancelled()
+    except QueryCancelled:
+        session.lock.release()
+        raise
+
+def _response_completed(active_query, stall_timeout=0, previous_responses=0):
+    """
+    Expected condition that returns 'completed' once the send button is active again.
+    With a stall_timeout it also returns 'stalled' once the new answer has stopped growing
+    for that many seconds. The wait is aborted as soon as the query is cancelled.
+    """
+    from selenium.webdriver.support import expected_conditions as EC
+
+    send_button_clickable = EC.element_to_be_clickable(SUBMIT_BUTTON_SELECTORS[0])
+    progress = {'length': 0, 'changed_at': time.monotonic()}
+
+    def condition(driver):
+        active_query.raise_if_cancelled()
+        if send_button_clickable(driver):
+            return 'completed'
+        if stall_timeout:
+            # Only look at answers added after submission, not the previous one.
+            response_elements = driver.find_elements(*RESPONSE_CONTENT_SELECTOR)
+            length = len(response_elements[-1].text) if len(response_elements) > previous_responses else 0
+            now = time.monotonic()
+            if length != progress['length']:
+                progress.update(length=length, changed_at=now)
+            elif length and now - progress['changed_at'] >= stall_timeout:
+                return 'stalled'
+        return False
+
+    return condition
+
+def _notebook_key(url):
+    """Identifies a notebook by its URL without query string or fragment."""
+    parts = urlsplit(url or '')
+    return f"{parts.scheme}://{parts.netloc}{parts.path}"
+
+def _stop_generation(driver):
+    """Presses NotebookLM's stop-generation control if it is currently shown."""
+    from selenium.common.exceptions import NoSuchElementException
+
+    for by, value in STOP_GENERATION_SELECTORS:
+        try:
+            stop_button = driver.find_element(by, value)
+            if stop_button.is_displayed() and stop_button.is_enabled():
+                stop_button.click()
+                logger.info("Stopped response generation.")
+                return True
+        except NoSuchElementException:
+            continue
+        except Exception as e:
+            logger.warning(f"Could not press stop-generation control: {e}")
+            return False
+    return False
+
+def _latest_response_text(driver):
+    response_elements = driver.find_elements(*RESPONSE_CONTENT_SELECTOR)
+    return response_elements[-1].text if response_elements else None
+
+def _cancelled_result(active_query, query, response_content=None):
+    logger.info(f"Query {active_query.query_id} cancelled ({active_query.cancel_reason}).")
+    return {
+        'success': False,
+        'message': 'Query was cancelled before it completed.',
+        'query': query,
+        'response_content': response_content,
+        'content_length': len(response_content) if response_content else 0,
+        'status': 'cancelled',
+        'cancel_reason': active_query.cancel_reason
+    }, CLIENT_CLOSED_REQUEST
+
+def _execute_query(active_query, session, query, timeout, notebooklm_url=None,
+                   adaptive=False, expected_length=None, stall_timeout=0):
+    """
+    Submits the query to the session's browser and waits for the answer.
+    Returns a (result dict, HTTP status code) tuple.
+    """
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.common.exceptions import TimeoutException, StaleElementReferenceException
+
+    active_query.hub_url = session.hub_url
+    try:
+        with tracer.span('query.lock_wait', query_id=active_query.query_id, hub_url=session.hub_url):
+            _acquire_browser_lock(active_query, session)
+    except QueryCancelled:
+        return _cancelled_result(active_query, query)
+
+    browser_instance = session.driver
+    hub_router.query_started(session.hub_url)
+    notebook, deadline = None, {}
     try:
-        with browser_lock:
+        if browser_instance is None:
+            return {'error': 'Browser was closed before the query could run.'}, 503
+        # Keep the notebook open in its hub's browser, so later queries find a warm tab.
+        if notebooklm_url and _notebook_key(browser_instance.current_url) != _notebook_key(notebooklm_url):
+            logger.info(f"Opening {notebooklm_url} on hub {session.hub_url} before querying.")
+            with tracer.span('query.open_notebook'):
+                _load_notebook_page(session, notebooklm_url)
+        notebook = _notebook_key(browser_instance.current_url)
+        timeout_basis = 'fixed'
+        if adaptive:
+            timeout, timeout_basis = latency_tracker.adaptive_timeout(
+                notebook, ADAPTIVE_TIMEOUT_PERCENTILE, ADAPTIVE_TIMEOUT_MARGIN,
+                ADAPTIVE_TIMEOUT_MIN, timeout, DEFAULT_QUERY_TIMEOUT, bucket=expected_length
+            )
+            logger.info(f"Adaptive timeout for {notebook}: {timeout} seconds ({timeout_basis}).")
+        deadline = {'timeout_seconds': timeout, 'timeout_basis': timeout_basis}
+
+        with tracer.span('query.submit', query_length=len(query)):
             # Find the input field
             input_element = find_element_by_priority(browser_instance, CHAT_INPUT_SELECTORS, condition=EC.element_to_be_clickable, timeout=30)
             if not input_element:
-                return jsonify({'error': 'Could not find chat input field'}), 500
-            
+                return {'error': 'Could not find chat input field'}, 500
+
             # Clear and enter the query
             input_element.clear()
             input_element.send_keys(query)
-            
+
+            previous_responses = len(browser_instance.find_elements(*RESPONSE_CONTENT_SELECTOR)) if stall_timeout else 0
+
             # Submit the query
             submit_button = find_element_by_priority(browser_instance, SUBMIT_BUTTON_SELECTORS, condition=EC.element_to_be_clickable, timeout=5)
             if submit_button:
@@ -283,70 +1000,162 @@ def query_notebooklm():
                 # Fallback to pressing Enter if button not found/clickable
                 from selenium.webdriver.common.keys import Keys
                 input_element.send_keys(Keys.RETURN)
-            
-            logger.info("Query submitted, waiting for response...")
-            
-            # Wait for the response to finish by checking if the submit button is active again.
-            response_wait = WebDriverWait(browser_instance, timeout)
-            response_wait.until(EC.element_to_be_clickable(SUBMIT_BUTTON_SELECTORS[0]))
-            logger.info("Content generation completed (send button is active).")
-
-            # Extract the response content
-            response_elements = browser_instance.find_elements(*RESPONSE_CONTENT_SELECTOR)
-            response_content = response_elements[-1].text if response_elements else None
-            
-            if response_content:
-                logger.info(f"Extracted response content (length: {len(response_content)}).")
-            else:
-                logger.warning("Could not find any response content elements.")
-            
-            return jsonify({
-                'success': True,
-                'message': 'Query completed successfully',
+        
+        logger.info("Query submitted, waiting for response...")
+        submitted_at = time.monotonic()
+        
+        # Wait for the response to finish by checking if the submit button is active again.
+        try:
+            with tracer.span('query.wait_for_response', timeout_seconds=timeout) as wait_span:
+                response_wait = WebDriverWait(browser_instance, timeout, ignored_exceptions=[StaleElementReferenceException])
+                outcome = response_wait.until(_response_completed(active_query, stall_timeout, previous_responses))
+                if wait_span:
+                    wait_span.set_attribute('outcome', outcome)
+        except QueryCancelled:
+            # Free the browser for the next query straight away instead of letting it keep generating.
+            _stop_generation(browser_instance)
+            return _cancelled_result(active_query, query, _latest_response_text(browser_instance))
+        elapsed = time.monotonic() - submitted_at
+
+        if outcome == 'stalled':
+            logger.warning(f"Response stopped growing for {stall_timeout} seconds. Returning partial content.")
+            _stop_generation(browser_instance)
+            response_content = _latest_response_text(browser_instance)
+            return {
+                'success': False,
+                'message': 'Response stopped growing, partial content returned.',
                 'query': query,
                 'response_content': response_content,
-                'content_length': len(response_content) if response_content else 0
-            })
+                'content_length': len(response_content) if response_content else 0,
+                'generation_time_seconds': round(elapsed, 2),
+                'status': 'stalled',
+                **deadline
+            }, 206 # Partial Content
+        logger.info("Content generation completed (send button is active).")
+
+        # Extract the response content
+        with tracer.span('query.extract_response'):
+            response_content = _latest_response_text(browser_instance)
+        
+        if response_content:
+            logger.info(f"Extracted response content (length: {len(response_content)}).")
+        else:
+            logger.warning("Could not find any response content elements.")
+        latency_tracker.record(notebook, elapsed, len(response_content) if response_content else 0)
+        
+        return {
+            'success': True,
+            'message': 'Query completed successfully',
+            'query': query,
+            'response_content': response_content,
+            'content_length': len(response_content) if response_content else 0,
+            'generation_time_seconds': round(elapsed, 2),
+            **deadline
+        }, 200
 
     except TimeoutException:
         logger.warning("Timed out waiting for response to complete. Extracting whatever content is available.")
+        # Stop generating so the timed-out answer does not keep the browser busy.
+        _stop_generation(browser_instance)
         # Even on timeout, try to grab the content that has been generated so far.
-        response_elements = browser_instance.find_elements(*RESPONSE_CONTENT_SELECTOR)
-        response_content = response_elements[-1].text if response_elements else "Response timed out, no content extracted."
-        return jsonify({
+        response_content = _latest_response_text(browser_instance)
+        # Record the timeout as a (lower bound) sample so slow tails keep the deadlines from shrinking.
+        latency_tracker.record(notebook, timeout, len(response_content) if response_content else 0)
+        response_content = response_content or "Response timed out, no content extracted."
+        return {
             'success': False,
             'message': 'Query timed out, partial content may be available.',
             'query': query,
             'response_content': response_content,
             'content_length': len(response_content) if response_content else 0,
-            'status': 'timeout'
-        }), 206 # Partial Content
+            'status': 'timeout',
+            **deadline
+        }, 206 # Partial Content
     except Exception as e:
         logger.error(f"An unexpected error occurred during query: {str(e)}", exc_info=True)
-        return jsonify({'error': f'Failed to query NotebookLM: {str(e)}'}), 500
+        return {'error': f'Failed to query NotebookLM: {str(e)}'}, 500
+    finally:
+        hub_router.query_finished(session.hub_url)
+        session.last_activity = time.monotonic()
+        session.lock.release()
+
+@notebooklm_bp.route('/latency_stats', methods=['GET'])
+def get_latency_stats():
+    """
+    Reports the answer time distributions used for adaptive query deadlines.
+    """
+    return jsonify({
+        'timeout_mode': QUERY_TIMEOUT_MODE,
+        'percentile': ADAPTIVE_TIMEOUT_PERCENTILE,
+        'notebooks': latency_tracker.snapshot(ADAPTIVE_TIMEOUT_PERCENTILE)
+    })
+
+@notebooklm_bp.route('/query_cache', methods=['GET'])
+def get_query_cache():
+    """
+    Reports how many answers are cached per notebook for near-duplicate lookups.
+    """
+    return jsonify({'enabled': SIMILARITY_CACHE_ENABLED, **query_cache.snapshot()})
+
+@notebooklm_bp.route('/query_cache', methods=['DELETE'])
+def clear_query_cache():
+    """
+    Drops all cached answers, e.g. after a notebook's sources have changed.
+    """
+    query_cache.clear()
+    return jsonify({'success': True, 'message': 'Query cache cleared'})
+
+@notebooklm_bp.route('/webhooks', methods=['GET'])
+def get_webhooks():
+    """
+    Reports webhook deliveries by status and the most recent failed deliveries.
+    """
+    return jsonify(webhook_dispatcher.snapshot())
+
+@notebooklm_bp.route('/queries', methods=['GET'])
+def list_queries():
+    """
+    Lists the queries that are currently waiting for or using the browser.
+    """
+    with active_queries_lock:
+        queries = [active_query.to_dict() for active_query in active_queries.values()]
+    return jsonify({'queries': queries})
+
+@notebooklm_bp.route('/queries/<query_id>', methods=['DELETE'])
+def cancel_query(query_id):
+    """
+    Cancels an in-flight query. The running request stops waiting, generation is
+    stopped in NotebookLM and the browser is released for the next query.
+    """
+    with active_queries_lock:
+        active_query = active_queries.get(query_id)
+    if not active_query:
+        return jsonify({'error': f"No in-flight query with id '{query_id}'"}), 404
+
+    active_query.cancel('cancelled_by_client')
+    return jsonify({
+        'success': True,
+        'message': 'Cancellation requested',
+        'query_id': query_id,
+        'status': 'cancelling'
+    }), 202
 
 @notebooklm_bp.route('/close_browser', methods=['POST'])
 def close_browser():
     """
-    Endpoint 3: Closes the Chrome driver
+    Endpoint 3: Closes the Chrome driver on every hub
     """
-    global browser_instance
-    
     try:
-        with browser_lock:
-            if browser_instance:
-                logger.info("Closing browser instance")
-                browser_instance.quit()
-                browser_instance = None
-                return jsonify({
-                    'success': True,
-                    'message': 'Browser closed successfully'
-                })
-            else:
-                return jsonify({
-                    'success': True,
-                    'message': 'No browser instance to close'
-                })
+        if close_all_browsers():
+            return jsonify({
+                'success': True,
+                'message': 'Browser closed successfully'
+            })
+        else:
+            return jsonify({
+                'success': True,
+                'message': 'No browser instance to close'
+            })
     
     except Exception as e:
         logger.error(f"Error closing browser: {str(e)}")
@@ -357,14 +1166,23 @@ def get_status():
     """
     Additional endpoint to check the status of the browser instance.
     This provides a health check for the Selenium integration.
+    The top-level fields describe the default session; "hubs" and "sessions" cover every hub.
     """
-    global browser_instance
-    
-    with browser_lock:
+    session = default_session
+    hubs = {
+        'hubs': hub_router.snapshot(),
+        'sessions': [browser_session.to_dict() for browser_session in browser_sessions.values()],
+        'keep_warm': {'enabled': KEEPWARM_ENABLED, 'running': keep_warm.running},
+        'driver_backend': DRIVER_BACKEND
+    }
+
+    with session.lock:
+        browser_instance = session.driver
         if not browser_instance:
             return jsonify({
                 'browser_active': False,
-                'status': 'not_initialized'
+                'status': 'not_initialized',
+                **hubs
             })
         
         try:
@@ -380,51 +1198,117 @@ def get_status():
                 'browser_active': True,
                 'current_url': current_url,
                 'page_title': title,
-                'status': status
+                'hub_url': session.hub_url,
+                'status': status,
+                **hubs
             })
         except Exception as e:
             # This exception block catches errors if the browser has crashed or is unresponsive.
             logger.error(f"Browser instance is unresponsive, marking as inactive. Error: {e}")
-            browser_instance = None # Clean up the dead instance
-            start_browser_initialization_thread() # Attempt to self-heal by restarting initialization
-            return jsonify({
-                'browser_active': False,
-                'status': 'inactive',
-                'error': f"Browser was unresponsive and has been cleaned up. Details: {str(e)}"
-            }), 503 # Service Unavailable
+            session.driver = None # Clean up the dead instance
+            error = str(e)
+    # Attempt to self-heal by restarting initialization (outside the lock, which it acquires)
+    start_browser_initialization_thread(session)
+    return jsonify({
+        'browser_active': False,
+        'status': 'inactive',
+        'error': f"Browser was unresponsive and has been cleaned up. Details: {error}",
+        **hubs
+    }), 503 # Service Unavailable
 
 @notebooklm_bp.route('/screenshot', methods=['GET'])
 def get_screenshot():
     """
     Additional endpoint to capture a screenshot of the current browser page for debugging.
+    An optional "notebooklm_url" query parameter selects the browser on that notebook's hub.
+    Optional query parameters: "format" (png, jpeg or webp), "quality" (1-100, for jpeg and
+    webp), "scale" (downscale factor above 0 and up to 1) and "element" (capture only one page
+    area: chat, sources or input). Format conversion and scaling require Pillow.
+    Screenshots are cached for SCREENSHOT_CACHE_TTL seconds and served with an ETag, and a
+    browser that is busy with a query serves its last screenshot instead of waiting.
     """
-    global browser_instance
-    
-    with browser_lock:
-        if not browser_instance:
-            return jsonify({'error': 'Browser not initialized.'}), 400
-        
-        try:
-            # Get screenshot as PNG
-            png_data = browser_instance.get_screenshot_as_png()
-            
-            # Return the image file
-            return send_file(
-                io.BytesIO(png_data),
-                mimetype='image/png'
-            )
-        except Exception as e:
-            logger.error(f"Error taking screenshot: {str(e)}")
-            return jsonify({'error': f'Failed to take screenshot: {str(e)}'}), 500
+    session = get_session(request.args.get('notebooklm_url'))
+
+    image_format = request.args.get('format', 'png').lower()
+    image_format = 'jpeg' if image_format == 'jpg' else image_format
+    if image_format not in IMAGE_FORMATS:
+        return jsonify({'error': f"format must be one of {', '.join(IMAGE_FORMATS)}"}), 400
+    try:
+        quality = int(request.args.get('quality', DEFAULT_SCREENSHOT_QUALITY))
+        scale = float(request.args.get('scale', 1))
+    except ValueError:
+        return jsonify({'error': 'quality must be an integer and scale a number'}), 400
+    if not 1 <= quality <= 100 or not 0 < scale <= 1:
+        return jsonify({'error': 'quality must be between 1 and 100 and scale above 0 and at most 1'}), 400
+    element = request.args.get('element')
+    if element is not None and element not in SCREENSHOT_ELEMENT_SELECTORS:
+        return jsonify({'error': f"element must be one of {', '.join(SCREENSHOT_ELEMENT_SELECTORS)}"}), 400
+    if (image_format != 'png' or scale != 1) and not encoding_available():
+        return jsonify({'error': 'Converting or scaling screenshots requires Pillow to be installed.'}), 400
+
+    cache_key = (session.hub_url, image_format, quality if image_format != 'png' else None, scale, element)
+    snapshot = screenshot_cache.get(cache_key)
+    if snapshot is None:
+        # Never queue behind a running query: fall back to the last screenshot if the browser is busy.
+        if not session.lock.acquire(blocking=False):
+            snapshot = screenshot_cache.latest(cache_key)
+            if snapshot is None:
+                return jsonify({'error': 'Browser is busy with a query. Try again shortly.'}), 503, {'Retry-After': '1'}
+        else:
+            try:
+                browser_instance = session.driver
+                if not browser_instance:
+                    return jsonify({'error': 'Browser not initialized.'}), 400
+                png_data = _capture_screenshot(browser_instance, element)
+                if png_data is None:
+                    return jsonify({'error': f"Could not find the '{element}' element on the page."}), 404
+            except Exception as e:
+                logger.error(f"Error taking screenshot: {str(e)}")
+                return jsonify({'error': f'Failed to take screenshot: {str(e)}'}), 500
+            finally:
+                session.lock.release()
+            # Encoding happens outside the lock, so queries can use the browser meanwhile.
+            try:
+                image_data = encode_screenshot(png_data, image_format, quality, scale)
+            except Exception as e:
+                logger.error(f"Error encoding screenshot: {str(e)}")
+                return jsonify({'error': f'Failed to encode screenshot: {str(e)}'}), 500
+            snapshot = screenshot_cache.put(cache_key, image_data, IMAGE_FORMATS[image_format])
+
+    response = send_file(
+        io.BytesIO(snapshot.data),
+        mimetype=snapshot.mimetype,
+        etag=snapshot.etag,
+        last_modified=snapshot.captured_at,
+        max_age=int(SCREENSHOT_CACHE_TTL),
+        conditional=True
+    )
+    response.headers['X-Screenshot-Age'] = f"{snapshot.age:.1f}"
+    return response
+
+def _capture_screenshot(driver, element=None):
+    """
+    Returns a PNG of the page, or of the named page area. Returns None if the area is not
+    on the page. Elements are looked up without waiting, as the page is already loaded.
+    """
+    if element is None:
+        return driver.get_screenshot_as_png()
+    for by, value in SCREENSHOT_ELEMENT_SELECTORS[element]:
+        elements = driver.find_elements(by, value)
+        if elements:
+            return elements[0].screenshot_as_png
+    return None
 
 @notebooklm_bp.route('/page_title', methods=['GET'])
 def get_page_title():
     """
     Returns the title of the currently active page in the browser.
+    An optional "notebooklm_url" query parameter selects the browser on that notebook's hub.
     """
-    global browser_instance
-    
-    with browser_lock:
+    session = get_session(request.args.get('notebooklm_url'))
+
+    with session.lock:
+        browser_instance = session.driver
         if not browser_instance:
             return jsonify({'error': 'Browser not initialized.'}), 400
         
@@ -437,10 +1321,12 @@ def get_page_title():
             })
         except Exception as e:
             logger.error(f"Browser instance is unresponsive while getting title, marking as inactive. Error: {e}")
-            browser_instance = None # Clean up the dead instance
-            start_browser_initialization_thread() # Attempt to self-heal by restarting initialization
-            return jsonify({
-                'browser_active': False,
-                'status': 'inactive',
-                'error': f"Browser was unresponsive while getting title. Details: {str(e)}"
-            }), 503 # Service Unavailable
+            session.driver = None # Clean up the dead instance
+            error = str(e)
+    # Attempt to self-heal by restarting initialization (outside the lock, which it acquires)
+    start_browser_initialization_thread(session)
+    return jsonify({
+        'browser_active': False,
+        'status': 'inactive',
+        'error': f"Browser was unresponsive while getting title. Details: {error}"
+    }), 503 # Service Unavailable
@@ -0,0 +1,125 @@
+import gzip
+import logging
+import os
+import zlib
+
+# Brotli is optional; without it responses are compressed with gzip only.
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Responses smaller than this many bytes are sent uncompressed; compressing them saves little.
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 6))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', 5))
+
+COMPRESSIBLE_MIMETYPES = {
+    'application/json',
+    'application/javascript',
+    'text/html',
+    'text/css',
+    'text/plain',
+    'image/svg+xml',
+}
+# Streamed responses of these types are compressed chunk by chunk, flushing after every chunk.
+STREAMING_MIMETYPES = {'application/x-ndjson', 'text/event-stream'}
+
+def parse_fields(value):
+    """
+    Parses a `fields` projection given as a list or a comma-separated string. Returns None if unset.
+    Raises ValueError for anything else, such as a number or a list that holds non-strings.
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.split(',')
+    if not isinstance(value, list) or not all(isinstance(field, str) for field in value):
+        raise ValueError('fields must be a list of field names or a comma-separated string')
+    fields = [field.strip() for field in value if field.strip()]
+    return fields or None
+
+def project_fields(data, fields):
+    """Keeps only the requested top-level fields of a dict, or of each dict in a list."""
+    if not fields:
+        return data
+    if isinstance(data, list):
+        return [project_fields(item, fields) for item in data]
+    if isinstance(data, dict):
+        return {key: value for key, value in data.items() if key in fields}
+    return data
+
+def available_encodings():
+    """Supported content codings, most preferred first."""
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+def choose_encoding(accept_encodings):
+    """
+    Picks the best supported coding from a parsed Accept-Encoding header (werkzeug's
+    request.accept_encodings), honouring q-values; q=0 rules a coding out. Returns None
+    if the client accepts none of them.
+    """
+    best, best_quality = None, 0
+    for encoding in available_encodings():
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+def compress_stream(chunks, encoding):
+    """Compresses an iterable of chunks incrementally, flushing after each so events are not held back."""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        for chunk in chunks:
+            data = compressor.process(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+            yield data + compressor.flush()
+        yield compressor.finish()
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+        for chunk in chunks:
+            data = compressor.compress(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+            yield data + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+
+def compress_response(response, accept_encodings):
+    """
+    Compresses a Flask response in place for the client's Accept-Encoding: JSON and text
+    bodies of at least COMPRESSION_MIN_SIZE bytes, and NDJSON/SSE streams. Returns the response.
+    """
+    if response.status_code < 200 or response.status_code in (204, 304) or 'Content-Encoding' in response.headers:
+        return response
+    streaming = response.is_streamed and response.mimetype in STREAMING_MIMETYPES
+    if not streaming and (response.direct_passthrough or response.is_streamed
+                          or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    if not streaming and (response.content_length or 0) < COMPRESSION_MIN_SIZE:
+        return response
+
+    # The body now depends on Accept-Encoding, so caches must keep the variants apart.
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(accept_encodings)
+    if encoding is None:
+        return response
+
+    if streaming:
+        response.response = compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        compressed = compress(data, encoding)
+        if len(compressed) >= len(data):
+            return response
+        response.set_data(compressed)
+        if response.headers.get('ETag'):
+            # A strong validator must differ between codings of the same resource.
+            etag, weak = response.get_etag()
+            response.set_etag(f"{etag}-{encoding}", weak)
+    response.headers['Content-Encoding'] = encoding
+    return response
@@ -0,0 +1,92 @@
+import hashlib
+import importlib.util
+import io
+import threading
+import time
+from collections import OrderedDict
+
+IMAGE_FORMATS = {
+    'png': 'image/png',
+    'jpeg': 'image/jpeg',
+    'webp': 'image/webp'
+}
+
+def encoding_available():
+    """
+    Whether Pillow is installed, which converting and downscaling screenshots requires.
+    Pillow is optional; without it screenshots are served as captured, at full size as PNG.
+    It is only imported when a screenshot is converted, to keep it out of the app's startup.
+    """
+    return importlib.util.find_spec('PIL') is not None
+
+def encode_screenshot(png_data, image_format='png', quality=80, scale=1.0):
+    """
+    Converts a PNG screenshot to the requested format, optionally scaled down by `scale`.
+    PNG screenshots at full size are returned unchanged.
+    """
+    if image_format == 'png' and scale == 1:
+        return png_data
+    if not encoding_available():
+        raise RuntimeError('Pillow is required to convert or downscale screenshots')
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(png_data))
+    if scale != 1:
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        image = image.resize(size, Image.BILINEAR)
+    output = io.BytesIO()
+    if image_format == 'png':
+        image.save(output, format='PNG', optimize=True)
+    else:
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        image.save(output, format=image_format.upper(), quality=quality)
+    return output.getvalue()
+
+class Snapshot:
+    """An encoded screenshot with the ETag it is served under."""
+
+    def __init__(self, data, mimetype):
+        self.data = data
+        self.mimetype = mimetype
+        self.etag = hashlib.sha1(data).hexdigest()
+        self.captured_at = time.time()
+
+    @property
+    def age(self):
+        return time.time() - self.captured_at
+
+class ScreenshotCache:
+    """
+    Keeps the most recent snapshot per browser and capture options for `ttl` seconds,
+    so dashboards polling the screenshot endpoint do not hit the browser on every call.
+    """
+
+    def __init__(self, ttl=2.0, max_entries=32):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._snapshots = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the snapshot for `key` if it is younger than the TTL, otherwise None."""
+        snapshot = self.latest(key)
+        return snapshot if snapshot and snapshot.age <= self.ttl else None
+
+    def latest(self, key):
+        """Returns the last snapshot for `key` regardless of its age, or None."""
+        with self._lock:
+            return self._snapshots.get(key)
+
+    def put(self, key, data, mimetype):
+        snapshot = Snapshot(data, mimetype)
+        with self._lock:
+            self._snapshots.pop(key, None)
+            self._snapshots[key] = snapshot
+            while len(self._snapshots) > self.max_entries:
+                self._snapshots.popitem(last=False)
+        return snapshot
+
+    def clear(self):
+        with self._lock:
+            self._snapshots.clear()
@@ -0,0 +1,236 @@
+import hashlib
+import math
+import random
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from functools import lru_cache
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+# MinHash signatures: BANDS bands of ROWS hashes each. Queries whose term sets have a Jaccard
+# similarity above roughly (1 / BANDS) ** (1 / ROWS) are likely to share at least one band.
+MINHASH_BANDS = 8
+MINHASH_ROWS = 4
+MINHASH_PRIME = (1 << 61) - 1
+_minhash_random = random.Random(1337)
+MINHASH_PERMUTATIONS = [
+    (_minhash_random.randrange(1, MINHASH_PRIME), _minhash_random.randrange(MINHASH_PRIME))
+    for _ in range(MINHASH_BANDS * MINHASH_ROWS)
+]
+
+# Words that carry no meaning on their own for matching questions.
+STOP_WORDS = frozenset("""
+a an and are as at be by can could do does for from i in is it its me my of on or please
+should tell that the their there these this to was will with would you
+""".split())
+
+# Words that change what is being asked even when the rest of the query is the same ("when did
+# X launch" vs "why did X launch"). Stored queries only match if they use the same ones. The "t"
+# is what is left of contractions such as "don't" and "isn't" after tokenizing.
+QUESTION_WORDS = frozenset('how what when where which who whom whose why'.split())
+NEGATIONS = frozenset('cannot never no none nor not nothing t without'.split())
+
+def tokenize(text):
+    """Lowercases the text and splits it into words, dropping stop words."""
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOP_WORDS]
+
+def query_intent(terms):
+    """The question words and negations among a query's terms."""
+    return frozenset(term for term in terms if term in QUESTION_WORDS or term in NEGATIONS)
+
+def normalize(text):
+    """Canonical form of a query used for exact matches."""
+    return ' '.join(TOKEN_PATTERN.findall(text.lower()))
+
+@lru_cache(maxsize=65536)
+def _term_minhashes(term):
+    """The term's hash under every MinHash permutation. Cached, as the same terms recur across queries."""
+    value = int.from_bytes(hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest(), 'big')
+    return tuple((a * value + b) % MINHASH_PRIME for a, b in MINHASH_PERMUTATIONS)
+
+def minhash_bands(terms):
+    """Returns the MinHash band keys of a set of terms (empty for no terms)."""
+    if not terms:
+        return []
+    signature = [min(hashes) for hashes in zip(*(_term_minhashes(term) for term in terms))]
+    return [(band, tuple(signature[band * MINHASH_ROWS:(band + 1) * MINHASH_ROWS])) for band in range(MINHASH_BANDS)]
+
+class CachedAnswer:
+    def __init__(self, entry_id, query, answer, terms):
+        self.entry_id = entry_id
+        self.query = query
+        self.answer = answer
+        self.terms = terms
+        self.intent = query_intent(terms)
+        self.bands = minhash_bands(terms)
+        self.cached_at = time.time()
+
+class SimilarityIndex:
+    """
+    TF-IDF index of the queries answered for one notebook. Candidates for a lookup come
+    from an inverted index over the query's distinctive terms and from MinHash buckets
+    (which cover queries made only of common terms), and only those are scored, so
+    lookups stay fast with tens of thousands of stored queries.
+    """
+
+    def __init__(self, max_entries=50000, max_postings_scan=256, max_minhash_candidates=32):
+        self.max_entries = max_entries
+        # Terms in more entries than this are too common to enumerate; MinHash covers them.
+        self.max_postings_scan = max_postings_scan
+        # At most this many MinHash candidates, those sharing the most bands, are scored.
+        self.max_minhash_candidates = max_minhash_candidates
+        self._entries = OrderedDict()
+        self._exact = {}
+        self._postings = {}
+        self._buckets = {}
+        self._next_id = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _idf(self, term):
+        document_frequency = len(self._postings.get(term, ()))
+        return math.log((1 + len(self._entries)) / (1 + document_frequency)) + 1
+
+    def _weights(self, terms, idf_cache):
+        weights = {}
+        for term, count in terms.items():
+            if term not in idf_cache:
+                idf_cache[term] = self._idf(term)
+            weights[term] = count * idf_cache[term]
+        return weights
+
+    def add(self, query, answer):
+        normalized = normalize(query)
+        if normalized in self._exact:
+            self._remove(self._exact[normalized])
+        while len(self._entries) >= self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+        entry = CachedAnswer(self._next_id, query, answer, Counter(tokenize(query)))
+        self._next_id += 1
+        self._entries[entry.entry_id] = entry
+        self._exact[normalized] = entry.entry_id
+        for term in entry.terms:
+            self._postings.setdefault(term, set()).add(entry.entry_id)
+        for band in entry.bands:
+            self._buckets.setdefault(band, set()).add(entry.entry_id)
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        self._exact.pop(normalize(entry.query), None)
+        for term in entry.terms:
+            postings = self._postings[term]
+            postings.discard(entry_id)
+            if not postings:
+                del self._postings[term]
+        for band in entry.bands:
+            bucket = self._buckets[band]
+            bucket.discard(entry_id)
+            if not bucket:
+                del self._buckets[band]
+
+    def lookup(self, query, threshold):
+        """
+        Returns a (CachedAnswer, similarity) tuple for the most similar stored query with a
+        cosine similarity of at least `threshold` and the same question words and negations,
+        or None.
+        """
+        exact_id = self._exact.get(normalize(query))
+        if exact_id is not None:
+            return self._entries[exact_id], 1.0
+
+        query_terms = Counter(tokenize(query))
+        idf_cache = {}
+        query_weights = self._weights(query_terms, idf_cache)
+        query_norm = math.sqrt(sum(weight * weight for weight in query_weights.values()))
+        if not query_weights or not query_norm:
+            return None
+        intent = query_intent(query_terms)
+
+        # Prefix filtering: an entry sharing none of the heaviest terms can at most match the
+        # remaining terms, so once those alone cannot reach the threshold, stop adding candidates.
+        candidates = set()
+        skipped_common = False
+        remaining = query_norm * query_norm
+        for term, weight in sorted(query_weights.items(), key=lambda item: item[1], reverse=True):
+            if math.sqrt(max(remaining, 0.0)) / query_norm < threshold:
+                break
+            postings = self._postings.get(term, ())
+            if len(postings) <= self.max_postings_scan:
+                candidates.update(postings)
+                remaining -= weight * weight
+            else:
+                skipped_common = True
+        if skipped_common and math.sqrt(max(remaining, 0.0)) / query_norm >= threshold:
+            # The common terms left over could reach the threshold on their own, so fall back to
+            # the MinHash buckets, skipping ones as crowded as a common term. The share of bands an
+            # entry has in common with the query estimates their term overlap, so only the entries
+            # sharing the most bands are scored.
+            band_hits = Counter()
+            for band in minhash_bands(query_terms):
+                bucket = self._buckets.get(band, ())
+                if len(bucket) <= self.max_postings_scan:
+                    band_hits.update(bucket)
+            candidates.update(entry_id for entry_id, _ in band_hits.most_common(self.max_minhash_candidates))
+
+        best, best_similarity = None, 0.0
+        for entry_id in candidates:
+            entry = self._entries[entry_id]
+            if entry.intent != intent:
+                continue
+            # Only shared terms contribute to the dot product, so the query's weight on them bounds
+            # the similarity; this rules out most candidates before weighting the entry's terms.
+            shared = sum(weight * weight for term, weight in query_weights.items() if term in entry.terms)
+            if math.sqrt(shared) / query_norm < threshold:
+                continue
+            dot, entry_norm = 0.0, 0.0
+            for term, count in entry.terms.items():
+                idf = idf_cache.get(term)
+                if idf is None:
+                    idf = idf_cache[term] = self._idf(term)
+                weight = count * idf
+                entry_norm += weight * weight
+                dot += weight * query_weights.get(term, 0.0)
+            similarity = dot / (query_norm * math.sqrt(entry_norm)) if entry_norm else 0.0
+            if similarity > best_similarity:
+                best, best_similarity = entry, similarity
+        if best is not None and best_similarity >= threshold:
+            return best, best_similarity
+        return None
+
+class QueryCache:
+    """Near-duplicate answer cache with one SimilarityIndex per notebook."""
+
+    def __init__(self, threshold=0.85, max_entries_per_notebook=50000):
+        self.threshold = threshold
+        self.max_entries_per_notebook = max_entries_per_notebook
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def store(self, notebook, query, answer):
+        with self._lock:
+            index = self._indexes.get(notebook)
+            if index is None:
+                index = self._indexes[notebook] = SimilarityIndex(self.max_entries_per_notebook)
+            index.add(query, answer)
+
+    def lookup(self, notebook, query, threshold=None):
+        with self._lock:
+            index = self._indexes.get(notebook)
+            if index is None:
+                return None
+            return index.lookup(query, self.threshold if threshold is None else threshold)
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'threshold': self.threshold,
+                'notebooks': [{'notebook': notebook, 'entries': len(index)} for notebook, index in self._indexes.items()]
+            }
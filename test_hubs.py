@@ -0,0 +1,69 @@
+import threading
+
+from hubs import HubRing, HubRouter
+
+HUBS = ['http://hub-a:4444/wd/hub', 'http://hub-b:4444/wd/hub', 'http://hub-c:4444/wd/hub']
+NOTEBOOKS = [f'https://notebooklm.google.com/notebook/{i}' for i in range(300)]
+
+def test_ring_spreads_notebooks_across_hubs():
+    ring = HubRing(HUBS)
+    owners = [ring.preference_list(notebook)[0] for notebook in NOTEBOOKS]
+    assert set(owners) == set(HUBS)
+    assert min(owners.count(hub) for hub in HUBS) > 50
+
+def test_ring_moves_only_the_removed_hubs_notebooks():
+    """Removing a hub only reassigns the notebooks that were routed to it."""
+    before = HubRing(HUBS)
+    after = HubRing(HUBS[:2])
+    for notebook in NOTEBOOKS:
+        owner = before.preference_list(notebook)[0]
+        if owner != HUBS[2]:
+            assert after.preference_list(notebook)[0] == owner
+
+def test_router_fails_over_to_next_hub(monkeypatch):
+    """A hub whose status check fails is skipped in favour of the next hub on the ring."""
+    router = HubRouter(HUBS)
+    notebook = NOTEBOOKS[0]
+    owner, fallback = router.ring.preference_list(notebook)[:2]
+    monkeypatch.setattr(router, 'check', lambda hub_url: router.mark_healthy(hub_url))
+
+    assert router.route(notebook) == owner
+    router.mark_failed(owner, 'connection refused')
+    assert router.route(notebook) == fallback
+
+    router.mark_healthy(owner)
+    assert router.route(notebook) == owner
+    assert router.snapshot()[HUBS.index(owner)]['consecutive_failures'] == 0
+
+def test_router_tracks_load():
+    router = HubRouter(HUBS[:1])
+    router.query_started(HUBS[0])
+    assert router.snapshot()[0]['active_queries'] == 1
+    router.query_finished(HUBS[0])
+    assert router.snapshot()[0]['active_queries'] == 0
+
+def test_router_checks_hubs_in_the_background(monkeypatch):
+    """Routing only reads cached health; status checks run on the health check thread."""
+    router = HubRouter(HUBS, check_interval=60)
+    checked = threading.Event()
+    checks = []
+
+    def check(hub_url):
+        checks.append(hub_url)
+        if hub_url == HUBS[0]:
+            router.mark_failed(hub_url, 'connection refused')
+        else:
+            router.mark_healthy(hub_url)
+        if len(checks) == len(HUBS):
+            checked.set()
+
+    monkeypatch.setattr(router, 'check', check)
+    router.route(NOTEBOOKS[0])
+    assert checks == []
+
+    assert router.start()
+    assert not router.start()
+    assert checked.wait(5)
+    router.stop()
+    assert all(router.route(notebook) != HUBS[0] for notebook in NOTEBOOKS)
+    assert not HubRouter(HUBS[:1]).start()
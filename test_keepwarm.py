@@ -0,0 +1,46 @@
+import time
+from datetime import datetime
+
+import pytest
+
+from keepwarm import KeepWarmPlanner, KeepWarmScheduler, next_scheduled_time, parse_schedule
+
+def test_parse_schedule():
+    assert parse_schedule('17:30, 9:00') == [(9, 0), (17, 30)]
+    assert parse_schedule('') == []
+    for value in ('25:00', '9am', '9'):
+        with pytest.raises(ValueError):
+            parse_schedule(value)
+
+def test_next_scheduled_time_wraps_to_tomorrow():
+    now = datetime(2026, 1, 5, 18, 0)
+    assert next_scheduled_time([(9, 0), (17, 30)], now) == datetime(2026, 1, 6, 9, 0)
+    assert next_scheduled_time([], now) is None
+
+def test_session_action():
+    planner = KeepWarmPlanner(idle_seconds=300, refresh_seconds=3000)
+    assert planner.session_action(idle_for=10, page_age=100) is None
+    assert planner.session_action(idle_for=400, page_age=100) == 'touch'
+    assert planner.session_action(idle_for=10, page_age=3500) == 'refresh'
+
+def test_pinned_slot_opens_ahead_of_schedule_once():
+    planner = KeepWarmPlanner(schedule=[(9, 0)], lead_seconds=600)
+    assert planner.pinned_slot(datetime(2026, 1, 5, 8, 0)) is None
+    slot = planner.pinned_slot(datetime(2026, 1, 5, 8, 55))
+    assert slot == datetime(2026, 1, 5, 9, 0).isoformat()
+    planner.mark_warmed('nb', slot)
+    assert planner.is_warmed('nb', planner.pinned_slot(datetime(2026, 1, 5, 8, 58)))
+    assert KeepWarmPlanner().pinned_slot(datetime(2026, 1, 5, 8, 0)) == 'startup'
+
+def test_scheduler_runs_ticks_until_stopped():
+    ticks = []
+    scheduler = KeepWarmScheduler(lambda: ticks.append(1), interval=0.01)
+    assert scheduler.start()
+    assert not scheduler.start()
+    deadline = time.time() + 2
+    while len(ticks) < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    scheduler.stop()
+    scheduler._thread.join(1)
+    assert len(ticks) >= 2
+    assert not scheduler.running
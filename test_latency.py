@@ -0,0 +1,28 @@
+from latency import LatencyTracker, length_bucket, percentile
+
+def test_length_buckets():
+    assert length_bucket(10) == 'short'
+    assert length_bucket(1500) == 'medium'
+    assert length_bucket(5000) == 'long'
+
+def test_percentile_nearest_rank():
+    assert percentile([1, 2, 3, 4, 5, 6, 7, 8, 9, 10], 90) == 9
+    assert percentile([7], 95) == 7
+
+def test_adaptive_timeout_falls_back_to_default():
+    """Without enough history the default deadline is used."""
+    tracker = LatencyTracker(min_samples=5)
+    tracker.record('nb', 30, 100)
+    assert tracker.adaptive_timeout('nb', 95, 1.5, 10, 300, 120) == (120, 'default')
+
+def test_adaptive_timeout_prefers_length_bucket():
+    """The expected length bucket is used once it has enough samples, and results are clamped."""
+    tracker = LatencyTracker(min_samples=2)
+    for seconds in (5, 6):
+        tracker.record('nb', seconds, 100)
+    for seconds in (100, 150):
+        tracker.record('nb', seconds, 5000)
+
+    assert tracker.adaptive_timeout('nb', 95, 1.5, 10, 300, 120, bucket='short') == (10, 'p95/short')
+    assert tracker.adaptive_timeout('nb', 95, 1.5, 10, 300, 120, bucket='long') == (225, 'p95/long')
+    assert tracker.adaptive_timeout('nb', 95, 1.5, 10, 200, 120) == (200, 'p95')
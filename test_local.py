@@ -4,6 +4,7 @@ Local test script for the NotebookLM Automation API.
 This script runs a series of live tests against a running instance of the application.
 """
 
+import os
 import sys
 import requests
 import time
@@ -15,12 +16,14 @@ import json
 def check_flask_app_import():
     """A simple pre-check to ensure the Flask app can be imported."""
     print("▶️  Running: Basic Flask app import check...")
+    # Lazy startup keeps the import check from creating the database or starting a browser.
+    os.environ.setdefault('STARTUP_MODE', 'lazy')
     try:
-        from main import app
+        from main import app, startup_metrics
         # A simple check to ensure the app object is valid
         with app.app_context():
             pass
-        print("✅ PASSED: Flask app imports and context works.")
+        print(f"✅ PASSED: Flask app imports and context works (imported in {startup_metrics['import_seconds']}s).")
         return True
     except ImportError as e:
         print(f"❌ FAILED: Could not import Flask app from main.py. Error: {e}")
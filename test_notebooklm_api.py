@@ -0,0 +1,484 @@
+import base64
+import os
+import socket
+import threading
+import time
+
+import pytest
+from selenium.common.exceptions import NoSuchElementException
+
+# Keep the browser from starting when the app is imported.
+os.environ.setdefault('STARTUP_MODE', 'lazy')
+
+import notebooklm
+from main import app
+
+# An 8x4 pixel PNG returned as the fake browser's screenshot.
+SCREENSHOT_PNG = base64.b64decode(
+    'iVBORw0KGgoAAAANSUhEUgAAAAgAAAAECAIAAAA8r+mnAAAAFElEQVR4nGM8ISfHgA0wYRUlSwIAZiYBDHImCC4AAAAASUVORK5CYII='
+)
+
+class FakeElement:
+    """A minimal stand-in for a Selenium WebElement."""
+
+    def __init__(self, text='', on_click=None, enabled=lambda: True):
+        self.text = text
+        self.typed = ''
+        self._on_click = on_click
+        self._enabled = enabled
+
+    def is_displayed(self):
+        return True
+
+    def is_enabled(self):
+        return self._enabled()
+
+    def clear(self):
+        self.typed = ''
+
+    def send_keys(self, value):
+        self.typed += value
+
+    def click(self):
+        if self._on_click:
+            self._on_click()
+
+class FakeDriver:
+    """
+    Simulates the parts of the NotebookLM page used by the API. Submitting a query
+    starts a "generation" that lasts `generation_seconds`, during which the send
+    button is disabled and the stop button is shown.
+    """
+
+    def __init__(self, answer='The answer.', generation_seconds=0.0, partial_answer=None):
+        self.current_url = 'https://notebooklm.google.com/notebook/test'
+        self.title = 'NotebookLM'
+        self.answer = answer
+        self.generation_seconds = generation_seconds
+        self.partial_answer = partial_answer
+        self.generating_until = None
+        self.stop_clicks = 0
+        self.screenshots = 0
+        self.signed_out = False
+        self.scripts = []
+        self.responses = []
+        self.chat_input = FakeElement()
+        self.send_button = FakeElement(on_click=self._submit, enabled=lambda: not self.generating)
+        self.stop_button = FakeElement(on_click=self._stop)
+
+    @property
+    def generating(self):
+        if self.generating_until is not None and time.time() >= self.generating_until:
+            self.generating_until = None
+            self.responses.append(FakeElement(self.answer))
+        return self.generating_until is not None
+
+    def _submit(self):
+        self.generating_until = time.time() + self.generation_seconds
+        if self.partial_answer:
+            self.responses.append(FakeElement(self.partial_answer))
+
+    def _stop(self):
+        self.stop_clicks += 1
+        self.generating_until = None
+
+    def find_element(self, by, value):
+        if value == '[data-testid="chat-input"]':
+            return self.chat_input
+        if value == 'button[data-testid="send-button"]':
+            return self.send_button
+        if value == 'button[data-testid="stop-button"]' and self.generating:
+            return self.stop_button
+        raise NoSuchElementException(value)
+
+    def find_elements(self, by, value):
+        self.generating  # Settles a finished generation before reading responses.
+        return list(self.responses) if value == '.message-content' else []
+
+    def get(self, url):
+        self.current_url = url
+
+    def execute_script(self, script, *args):
+        self.scripts.append(script)
+        return 'complete'
+
+    def execute_async_script(self, script, *args):
+        self.scripts.append(script)
+        return {'status': 200, 'redirected': self.signed_out}
+
+    def get_screenshot_as_png(self):
+        self.screenshots += 1
+        return SCREENSHOT_PNG
+
+    def quit(self):
+        pass
+
+@pytest.fixture
+def client():
+    app.config.update({"TESTING": True})
+    with app.test_client() as testing_client:
+        yield testing_client
+
+@pytest.fixture
+def fake_driver(monkeypatch):
+    driver = FakeDriver()
+    monkeypatch.setattr(notebooklm.default_session, 'driver', driver)
+    monkeypatch.setattr(notebooklm.default_session, 'notebook_url', None)
+    monkeypatch.setattr(notebooklm, 'query_cache', notebooklm.QueryCache())
+    monkeypatch.setattr(notebooklm, 'screenshot_cache', notebooklm.ScreenshotCache(ttl=60))
+    return driver
+
+def test_query_returns_answer_and_query_id(client, fake_driver):
+    """A completed query returns the answer along with its query id."""
+    response = client.post('/api/query_notebooklm', json={'query': 'What is this?', 'query_id': 'q1'})
+    assert response.status_code == 200
+    assert response.json['response_content'] == 'The answer.'
+    assert response.json['query_id'] == 'q1'
+    assert fake_driver.chat_input.typed == 'What is this?'
+    assert notebooklm.active_queries == {}
+
+def test_cancel_unknown_query(client):
+    """Cancelling a query that is not running returns 404."""
+    response = client.delete('/api/queries/does-not-exist')
+    assert response.status_code == 404
+
+def test_cancel_in_flight_query(client, fake_driver):
+    """Cancelling stops the wait, presses stop and releases the browser."""
+    fake_driver.generation_seconds = 30
+    results = {}
+
+    def run_query():
+        with app.test_client() as query_client:
+            results['response'] = query_client.post(
+                '/api/query_notebooklm', json={'query': 'Slow question', 'query_id': 'slow', 'timeout': 30}
+            )
+
+    query_thread = threading.Thread(target=run_query)
+    query_thread.start()
+    for _ in range(50):
+        if fake_driver.generating:
+            break
+        time.sleep(0.05)
+
+    listing = client.get('/api/queries')
+    assert [q['query_id'] for q in listing.json['queries']] == ['slow']
+
+    started = time.time()
+    cancel_response = client.delete('/api/queries/slow')
+    assert cancel_response.status_code == 202
+    query_thread.join(timeout=5)
+
+    response = results['response']
+    assert time.time() - started < 5
+    assert response.status_code == notebooklm.CLIENT_CLOSED_REQUEST
+    assert response.json['status'] == 'cancelled'
+    assert response.json['cancel_reason'] == 'cancelled_by_client'
+    assert fake_driver.stop_clicks == 1
+    assert not notebooklm.default_session.lock.locked()
+
+def test_query_is_cancelled_when_client_disconnects(client, fake_driver):
+    """A query whose client has hung up is cancelled and releases the browser."""
+    fake_driver.generation_seconds = 30
+    client_end, server_end = socket.socketpair()
+    client_end.close()
+    try:
+        started = time.time()
+        response = client.post(
+            '/api/query_notebooklm', json={'query': 'Slow question', 'query_id': 'gone', 'timeout': 30},
+            environ_base={'werkzeug.socket': server_end}
+        )
+    finally:
+        server_end.close()
+
+    assert time.time() - started < 5
+    assert response.status_code == notebooklm.CLIENT_CLOSED_REQUEST
+    assert response.json['status'] == 'cancelled'
+    assert response.json['cancel_reason'] == 'client_disconnected'
+    assert not notebooklm.default_session.lock.locked()
+    assert notebooklm.active_queries == {}
+
+def test_duplicate_query_id_is_rejected(client, fake_driver):
+    """A query id that is already in flight cannot be reused."""
+    notebooklm._register_query('busy', {})
+    try:
+        response = client.post('/api/query_notebooklm', json={'query': 'Hello', 'query_id': 'busy'})
+        assert response.status_code == 409
+    finally:
+        notebooklm._unregister_query('busy')
+
+def test_stalled_answer_returns_partial_content(client, fake_driver):
+    """An answer that stops growing is returned early when stall_timeout is set."""
+    fake_driver.generation_seconds = 30
+    fake_driver.partial_answer = 'Half an'
+    started = time.time()
+    response = client.post('/api/query_notebooklm', json={'query': 'Q', 'timeout': 30, 'stall_timeout': 1})
+    assert time.time() - started < 5
+    assert response.status_code == 206
+    assert response.json['status'] == 'stalled'
+    assert response.json['response_content'] == 'Half an'
+    assert fake_driver.stop_clicks == 1
+
+def test_adaptive_timeout_uses_answer_history(client, fake_driver, monkeypatch):
+    """Adaptive mode derives the deadline from earlier answer times for the notebook."""
+    tracker = notebooklm.LatencyTracker(min_samples=3)
+    for seconds in (10, 12, 20):
+        tracker.record('https://notebooklm.google.com/notebook/test', seconds, 100)
+    monkeypatch.setattr(notebooklm, 'latency_tracker', tracker)
+
+    response = client.post('/api/query_notebooklm', json={'query': 'Q', 'timeout_mode': 'adaptive'})
+    assert response.status_code == 200
+    assert response.json['timeout_basis'].startswith('p')
+    assert response.json['timeout_seconds'] == 30  # p95 of 20s with the default 1.5x margin
+
+    stats = client.get('/api/latency_stats').json
+    assert stats['notebooks'][0]['samples'] == 4
+
+def test_invalid_timeout_mode(client, fake_driver):
+    response = client.post('/api/query_notebooklm', json={'query': 'Q', 'timeout_mode': 'sometimes'})
+    assert response.status_code == 400
+
+def test_invalid_stall_timeout(client, fake_driver):
+    for stall_timeout in ('soon', -1, None):
+        response = client.post('/api/query_notebooklm', json={'query': 'Q', 'stall_timeout': stall_timeout})
+        assert response.status_code == 400
+        assert 'stall_timeout' in response.json['error']
+
+def test_lazy_startup_defers_browser(client, monkeypatch):
+    """In lazy mode importing the app starts no browser; the first browser request does."""
+    started = []
+    monkeypatch.setattr(notebooklm.default_session, 'initialization_requested', False)
+    monkeypatch.setattr(notebooklm, 'start_browser_initialization_thread', lambda session=None: started.append(session))
+
+    metrics = client.get('/api/startup_metrics').json
+    assert metrics['startup_mode'] == 'lazy'
+    assert metrics['import_seconds'] >= 0
+    assert started == []
+
+    client.get('/api/status')
+    assert started == [notebooklm.default_session]
+
+def test_browser_initialization_retries_after_hub_recovers(monkeypatch):
+    """A hub that was down when its browser was first requested gets one once it is back."""
+    session = notebooklm.default_session
+    hub_down = True
+
+    def create_driver(hub_url):
+        if hub_down:
+            raise ConnectionError('hub is down')
+        return FakeDriver()
+
+    original_initialize_browser = notebooklm.initialize_browser
+    monkeypatch.setattr(session, 'driver', None)
+    monkeypatch.setattr(session, 'initialization_requested', False)
+    monkeypatch.setattr(session, 'initialization_thread', None)
+    monkeypatch.setattr(notebooklm, 'create_undetected_driver', create_driver)
+    monkeypatch.setattr(notebooklm, 'initialize_browser',
+                        lambda session: original_initialize_browser(session, max_retries=2, retry_delay=0))
+
+    notebooklm.ensure_browser_initialization_started(session)
+    session.initialization_thread.join(5)
+    assert session.driver is None
+    assert not session.initialization_requested
+
+    hub_down = False
+    notebooklm.ensure_browser_initialization_started(session)
+    session.initialization_thread.join(5)
+    assert isinstance(session.driver, FakeDriver)
+    assert notebooklm.hub_router.is_healthy(session.hub_url)
+
+def test_query_opens_requested_notebook_on_its_hub(client, fake_driver):
+    """A query naming another notebook opens it in the browser of the hub it routes to."""
+    notebook_url = 'https://notebooklm.google.com/notebook/other'
+    response = client.post('/api/query_notebooklm', json={'query': 'Q', 'notebooklm_url': notebook_url})
+    assert response.status_code == 200
+    assert fake_driver.current_url == notebook_url
+    assert notebooklm.hub_router.snapshot()[0]['active_queries'] == 0
+
+def test_responses_carry_trace_id(client, fake_driver):
+    """Each response returns a trace id, reusing a valid incoming one."""
+    response = client.get('/api/queries')
+    assert len(response.headers['X-Trace-Id']) == 32
+
+    response = client.get('/api/queries', headers={'X-Trace-Id': 'abcdef0123456789'})
+    assert response.headers['X-Trace-Id'] == 'abcdef0123456789'
+
+def test_similar_query_is_answered_from_cache(client, fake_driver):
+    """A rephrased query for the same notebook reuses the stored answer without the browser."""
+    notebook_url = 'https://notebooklm.google.com/notebook/test'
+    response = client.post('/api/query_notebooklm', json={
+        'query': 'Summarize the main findings of the quarterly report', 'notebooklm_url': notebook_url
+    })
+    assert response.status_code == 200
+    assert 'cache' not in response.get_json()
+
+    fake_driver.answer = 'A different answer.'
+    response = client.post('/api/query_notebooklm', json={
+        'query': 'Please summarize the main findings in the quarterly report', 'notebooklm_url': notebook_url
+    })
+    data = response.get_json()
+    assert response.status_code == 200
+    assert data['response_content'] == 'The answer.'
+    assert data['cache']['match'] == 'approximate'
+    assert data['cache']['matched_query'] == 'Summarize the main findings of the quarterly report'
+    assert len(fake_driver.responses) == 1
+
+    response = client.post('/api/query_notebooklm', json={
+        'query': 'Please summarize the main findings in the quarterly report',
+        'notebooklm_url': notebook_url, 'use_cache': False
+    })
+    assert response.get_json()['response_content'] == 'A different answer.'
+    assert client.get('/api/query_cache').get_json()['notebooks'][0]['entries'] == 2
+
+def test_invalid_similarity_threshold(client, fake_driver):
+    for threshold in ('abc', 0, 1.5, [1]):
+        response = client.post('/api/query_notebooklm', json={'query': 'Q', 'similarity_threshold': threshold})
+        assert response.status_code == 400
+        assert 'similarity_threshold' in response.json['error']
+
+def test_screenshot_is_cached_with_etag(client, fake_driver):
+    """Repeated polls are served from the snapshot cache and revalidate with the ETag."""
+    response = client.get('/api/screenshot')
+    assert response.status_code == 200
+    assert response.mimetype == 'image/png'
+    assert response.data == SCREENSHOT_PNG
+    etag = response.headers['ETag']
+
+    assert client.get('/api/screenshot').data == SCREENSHOT_PNG
+    response = client.get('/api/screenshot', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert fake_driver.screenshots == 1
+
+def test_screenshot_serves_last_snapshot_while_browser_is_busy(client, fake_driver, monkeypatch):
+    """A screenshot request never waits for the browser lock held by a running query."""
+    monkeypatch.setattr(notebooklm, 'screenshot_cache', notebooklm.ScreenshotCache(ttl=0))
+    client.get('/api/screenshot')
+    with notebooklm.default_session.lock:
+        response = client.get('/api/screenshot')
+        assert response.status_code == 200
+        assert response.data == SCREENSHOT_PNG
+    assert fake_driver.screenshots == 1
+
+def test_busy_browser_without_snapshot_returns_503(client, fake_driver):
+    """Without an earlier screenshot for the requested options, a busy browser returns 503."""
+    pytest.importorskip('PIL')
+    with notebooklm.default_session.lock:
+        response = client.get('/api/screenshot?scale=0.5')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    assert fake_driver.screenshots == 0
+
+def test_screenshot_conversion_and_scaling(client, fake_driver):
+    pytest.importorskip('PIL')
+    response = client.get('/api/screenshot?format=jpeg&quality=50&scale=0.5')
+    assert response.status_code == 200
+    assert response.mimetype == 'image/jpeg'
+    assert response.data[:2] == b'\xff\xd8'
+
+def test_screenshot_conversion_without_pillow(client, fake_driver, monkeypatch):
+    monkeypatch.setattr(notebooklm, 'encoding_available', lambda: False)
+    response = client.get('/api/screenshot?format=webp')
+    assert response.status_code == 400
+    assert 'Pillow' in response.json['error']
+    assert client.get('/api/screenshot').status_code == 200
+
+def test_screenshot_rejects_unknown_options(client, fake_driver):
+    assert client.get('/api/screenshot?format=gif').status_code == 400
+    assert client.get('/api/screenshot?scale=2').status_code == 400
+    assert client.get('/api/screenshot?element=footer').status_code == 400
+    assert client.get('/api/screenshot?element=chat').status_code == 404
+
+def test_keep_warm_touches_idle_sessions_only_when_free(client, fake_driver, monkeypatch):
+    """Keep-warm touches an idle notebook, but never while a query holds or waits for the browser."""
+    session = notebooklm.default_session
+    monkeypatch.setattr(session, 'notebook_url', 'https://notebooklm.google.com/notebook/test')
+    monkeypatch.setattr(session, 'page_loaded_at', time.monotonic())
+    monkeypatch.setattr(session, 'last_activity', time.monotonic() - notebooklm.KEEPWARM_IDLE_SECONDS - 1)
+
+    with session.lock:
+        assert notebooklm.keep_warm_pass() == []
+    notebooklm._register_query('waiting', {})
+    try:
+        assert notebooklm.keep_warm_pass() == []
+    finally:
+        notebooklm._unregister_query('waiting')
+    assert fake_driver.scripts == []
+
+    assert notebooklm.keep_warm_pass() == [(session.hub_url, 'touch')]
+    assert fake_driver.scripts == [notebooklm.KEEPWARM_TOUCH_SCRIPT]
+    assert not session.authentication_required
+    assert notebooklm.keep_warm_pass() == []
+
+    fake_driver.signed_out = True
+    monkeypatch.setattr(session, 'last_activity', time.monotonic() - notebooklm.KEEPWARM_IDLE_SECONDS - 1)
+    assert notebooklm.keep_warm_pass() == [(session.hub_url, 'touch')]
+    assert session.authentication_required
+
+def test_keep_warm_reopens_pinned_notebooks(client, fake_driver, monkeypatch):
+    """Pinned notebooks are opened ahead of traffic once per scheduled window."""
+    notebook_url = 'https://notebooklm.google.com/notebook/pinned'
+    monkeypatch.setattr(notebooklm, 'KEEPWARM_PINNED_NOTEBOOKS', [notebook_url])
+    monkeypatch.setattr(notebooklm, 'keep_warm_planner', notebooklm.KeepWarmPlanner())
+    assert notebooklm.keep_warm_pass() == [(notebooklm.default_session.hub_url, 'open_pinned')]
+    assert fake_driver.current_url == notebook_url
+    assert notebooklm.keep_warm_pass() == []
+
+def test_keep_warm_keeps_the_notebook_a_client_opened(client, fake_driver, monkeypatch):
+    """A pinned notebook is not opened over another notebook, and only one pinned notebook fits a browser."""
+    opened_url = 'https://notebooklm.google.com/notebook/opened'
+    pinned_urls = ['https://notebooklm.google.com/notebook/pinned-1', 'https://notebooklm.google.com/notebook/pinned-2']
+    monkeypatch.setattr(notebooklm, 'KEEPWARM_PINNED_NOTEBOOKS', pinned_urls)
+    monkeypatch.setattr(notebooklm, 'keep_warm_planner', notebooklm.KeepWarmPlanner())
+    monkeypatch.setattr(notebooklm.default_session, 'notebook_url', opened_url)
+    fake_driver.current_url = opened_url
+    monkeypatch.setattr(notebooklm.default_session, 'page_loaded_at', time.monotonic())
+
+    assert notebooklm.keep_warm_pass() == []
+    assert fake_driver.current_url == opened_url
+    assert notebooklm.default_session.notebook_url == opened_url
+
+    monkeypatch.setattr(notebooklm, 'keep_warm_planner', notebooklm.KeepWarmPlanner())
+    monkeypatch.setattr(notebooklm.default_session, 'notebook_url', None)
+    assert notebooklm.keep_warm_pass() == [(notebooklm.default_session.hub_url, 'open_pinned')]
+    assert notebooklm.keep_warm_pass() == []
+    assert fake_driver.current_url == pinned_urls[0]
+
+def test_driver_backends_keep_connections_alive(monkeypatch):
+    """The local backend starts chromedriver directly; both backends use keep-alive connections."""
+    from selenium import webdriver
+
+    created = []
+
+    def fake_driver_class(kind):
+        def create(**kwargs):
+            created.append((kind, kwargs))
+            return FakeDriver()
+        return create
+
+    monkeypatch.setattr(webdriver, 'Chrome', fake_driver_class('local'))
+    monkeypatch.setattr(webdriver, 'Remote', fake_driver_class('remote'))
+    monkeypatch.setattr(FakeDriver, 'set_page_load_timeout', lambda self, seconds: None, raising=False)
+    monkeypatch.setattr(FakeDriver, 'execute', lambda self, command, params=None: None, raising=False)
+    monkeypatch.setattr(notebooklm, 'CHROMEDRIVER_PATH', '/opt/chromedriver')
+
+    notebooklm.create_undetected_driver(notebooklm.LOCAL_DRIVER)
+    notebooklm.create_undetected_driver('http://hub-1:4444/wd/hub')
+
+    (local_kind, local_args), (remote_kind, remote_args) = created
+    assert local_kind == 'local' and local_args['keep_alive']
+    assert local_args['service'].path == '/opt/chromedriver'
+    assert remote_kind == 'remote'
+    assert remote_args['client_config'].keep_alive
+    assert remote_args['client_config'].remote_server_addr == 'http://hub-1:4444/wd/hub'
+
+def test_query_fields_projection(client, fake_driver):
+    """Clients can drop echoed fields from the query response."""
+    response = client.post('/api/query_notebooklm?fields=response_content,query_id', json={'query': 'Q', 'query_id': 'q1'})
+    assert response.get_json() == {'response_content': 'The answer.', 'query_id': 'q1'}
+    response = client.post('/api/query_notebooklm', json={'query': 'Q', 'timeout_mode': 'never', 'fields': ['query_id']})
+    assert 'error' in response.get_json()
+
+def test_invalid_fields(client, fake_driver):
+    for fields in (5, {'query_id': True}, ['query_id', 5]):
+        response = client.post('/api/query_notebooklm', json={'query': 'Q', 'fields': fields})
+        assert response.status_code == 400
+        assert 'fields' in response.json['error']
@@ -0,0 +1,77 @@
+import gzip
+import zlib
+
+import pytest
+from flask import Flask, Response, jsonify, request
+from werkzeug.http import parse_accept_header
+
+import responses
+from responses import choose_encoding, compress_response, parse_fields, project_fields
+
+app = Flask(__name__)
+
+@app.after_request
+def compress(response):
+    return compress_response(response, request.accept_encodings)
+
+@app.route('/large')
+def large():
+    return jsonify({'items': ['x' * 40] * 100})
+
+@app.route('/small')
+def small():
+    return jsonify({'ok': True})
+
+@app.route('/events')
+def events():
+    return Response((f"data: {i}\n\n" for i in range(3)), mimetype='text/event-stream')
+
+def test_parse_and_project_fields():
+    assert parse_fields('query_id, response_content') == ['query_id', 'response_content']
+    assert parse_fields(['a']) == ['a']
+    assert parse_fields('') is None and parse_fields(None) is None
+    for invalid in (5, {'a': 1}, ['a', 5]):
+        with pytest.raises(ValueError):
+            parse_fields(invalid)
+    assert project_fields({'a': 1, 'b': 2}, ['a']) == {'a': 1}
+    assert project_fields([{'a': 1, 'b': 2}], ['b']) == [{'b': 2}]
+    assert project_fields({'a': 1}, None) == {'a': 1}
+
+def test_choose_encoding_honours_q_values(monkeypatch):
+    monkeypatch.setattr(responses, 'brotli', None)
+    assert choose_encoding(parse_accept_header('gzip, deflate')) == 'gzip'
+    assert choose_encoding(parse_accept_header('gzip;q=0')) is None
+    assert choose_encoding(parse_accept_header('*')) == 'gzip'
+    assert choose_encoding(parse_accept_header('identity')) is None
+
+def test_large_responses_are_compressed():
+    client = app.test_client()
+    response = client.get('/large', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert gzip.decompress(response.data).startswith(b'{"items"')
+    assert int(response.headers['Content-Length']) == len(response.data)
+
+    response = client.get('/large')
+    assert 'Content-Encoding' not in response.headers
+    assert response.headers['Vary'] == 'Accept-Encoding'
+
+def test_small_responses_are_not_compressed():
+    response = app.test_client().get('/small', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+    assert response.get_json() == {'ok': True}
+
+def test_event_streams_are_compressed_incrementally():
+    response = app.test_client().get('/events', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Length' not in response.headers
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    chunks = [decompressor.decompress(chunk) for chunk in response.response]
+    # Every event can be decoded as soon as its chunk arrives.
+    assert chunks[:3] == [b'data: 0\n\n', b'data: 1\n\n', b'data: 2\n\n']
+
+def test_brotli_is_preferred_when_installed():
+    brotli = pytest.importorskip('brotli')
+    response = app.test_client().get('/large', headers={'Accept-Encoding': 'gzip;q=0.8, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert brotli.decompress(response.data).startswith(b'{"items"')
@@ -0,0 +1,38 @@
+import io
+import time
+
+import pytest
+
+from screenshots import ScreenshotCache, encode_screenshot
+
+def test_cache_expires_but_keeps_latest():
+    cache = ScreenshotCache(ttl=0.05)
+    snapshot = cache.put('key', b'image', 'image/png')
+    assert cache.get('key') is snapshot
+    time.sleep(0.1)
+    assert cache.get('key') is None
+    assert cache.latest('key') is snapshot
+
+def test_cache_is_bounded():
+    cache = ScreenshotCache(max_entries=2)
+    for key in ('a', 'b', 'c'):
+        cache.put(key, key.encode(), 'image/png')
+    assert cache.latest('a') is None
+    assert cache.latest('c').data == b'c'
+
+def test_etag_follows_content():
+    cache = ScreenshotCache()
+    assert cache.put('a', b'same', 'image/png').etag == cache.put('b', b'same', 'image/png').etag
+    assert cache.put('c', b'other', 'image/png').etag != cache.latest('a').etag
+
+def test_full_size_png_is_unchanged():
+    assert encode_screenshot(b'png bytes') == b'png bytes'
+
+def test_downscale_to_webp():
+    Image = pytest.importorskip('PIL.Image')
+    source = io.BytesIO()
+    Image.new('RGBA', (40, 20)).save(source, format='PNG')
+    data = encode_screenshot(source.getvalue(), 'webp', quality=60, scale=0.25)
+    image = Image.open(io.BytesIO(data))
+    assert image.format == 'WEBP'
+    assert image.size == (10, 5)
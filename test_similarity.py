@@ -0,0 +1,52 @@
+from similarity import QueryCache, SimilarityIndex, normalize, tokenize
+
+def test_tokenize_drops_stop_words():
+    assert tokenize('What are the KEY findings?') == ['what', 'key', 'findings']
+    assert normalize('  What are the KEY findings? ') == 'what are the key findings'
+
+def test_exact_and_approximate_matches():
+    index = SimilarityIndex()
+    index.add('Summarize the main findings of the report', 'Findings answer')
+    index.add('Who wrote the second chapter?', 'Chapter answer')
+
+    entry, similarity = index.lookup('summarize the MAIN findings of the report!', 0.9)
+    assert entry.answer == 'Findings answer' and similarity == 1.0
+
+    entry, similarity = index.lookup('Please summarize the main findings in the report', 0.8)
+    assert entry.answer == 'Findings answer' and 0.8 <= similarity <= 1.0
+
+    assert index.lookup('Summarize the budget', 0.8) is None
+
+def test_different_questions_are_not_matched():
+    """Queries that only differ in their question word or a negation ask something else."""
+    cache = QueryCache(threshold=0.5)
+    cache.store('nb', 'When did Acme launch the product?', 'In 2020')
+    assert cache.lookup('nb', 'Why did Acme launch the product?') is None
+    assert cache.lookup('nb', 'Where did Acme launch the product?') is None
+    assert cache.lookup('nb', "When didn't Acme launch the product?") is None
+    assert cache.lookup('nb', 'When did Acme launch their product?')[0].answer == 'In 2020'
+
+def test_queries_of_common_terms_are_found():
+    """Queries whose terms are all too common to scan through are still matched."""
+    index = SimilarityIndex(max_postings_scan=2, max_minhash_candidates=1)
+    for i in range(10):
+        index.add(f"report summary topic{i}", f"answer {i}")
+    index.add('report summary', 'common answer')
+
+    entry, _ = index.lookup('summary report', 0.9)
+    assert entry.answer == 'common answer'
+
+def test_oldest_entries_are_evicted():
+    index = SimilarityIndex(max_entries=2)
+    index.add('first question', 'a')
+    index.add('second question', 'b')
+    index.add('third question', 'c')
+    assert len(index) == 2
+    assert index.lookup('first question', 0.9) is None
+
+def test_cache_is_per_notebook():
+    cache = QueryCache(threshold=0.8)
+    cache.store('nb1', 'What is the conclusion?', 'Conclusion')
+    assert cache.lookup('nb1', 'what is the conclusion')[0].answer == 'Conclusion'
+    assert cache.lookup('nb2', 'What is the conclusion?') is None
+    assert cache.snapshot()['notebooks'] == [{'notebook': 'nb1', 'entries': 1}]
@@ -0,0 +1,61 @@
+import json
+
+import pytest
+
+from tracing import JsonlExporter, Tracer
+
+@pytest.fixture
+def export_path(tmp_path):
+    return tmp_path / 'traces.jsonl'
+
+def read_spans(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+def test_nested_spans_are_exported(export_path):
+    """Spans record their parent, and a sampled trace is written to the JSONL file."""
+    tracer = Tracer(sample_rate=1, exporter=JsonlExporter(str(export_path)))
+    tracer.start_trace('trace-1234')
+    with tracer.span('outer'):
+        with tracer.span('inner', command='findElement'):
+            pass
+    tracer.end_trace()
+
+    spans = {span['name']: span for span in read_spans(export_path)}
+    assert spans['inner']['parent_span_id'] == spans['outer']['span_id']
+    assert spans['inner']['attributes'] == {'command': 'findElement'}
+    assert all(span['trace_id'] == 'trace-1234' for span in spans.values())
+
+def test_unsampled_traces_are_not_exported(export_path):
+    tracer = Tracer(sample_rate=0, exporter=JsonlExporter(str(export_path)))
+    trace = tracer.start_trace()
+    with tracer.span('ignored') as span:
+        assert span is None
+    tracer.end_trace()
+    assert trace.trace_id
+    assert not export_path.exists()
+
+def test_span_records_errors(export_path):
+    tracer = Tracer(sample_rate=1, exporter=JsonlExporter(str(export_path)))
+    tracer.start_trace()
+    with pytest.raises(ValueError):
+        with tracer.span('failing'):
+            raise ValueError('boom')
+    tracer.end_trace()
+    assert read_spans(export_path)[0]['error'] == 'ValueError: boom'
+
+def test_instrument_driver_records_webdriver_commands(export_path):
+    """Every command sent through the driver's execute method becomes a span."""
+    class Driver:
+        def execute(self, driver_command, params=None):
+            return {'value': driver_command}
+
+    tracer = Tracer(sample_rate=1, exporter=JsonlExporter(str(export_path)))
+    driver = tracer.instrument_driver(Driver())
+    tracer.start_trace()
+    with tracer.span('query.submit'):
+        assert driver.execute('clickElement', {'id': '1'}) == {'value': 'clickElement'}
+    tracer.end_trace()
+
+    spans = {span['name']: span for span in read_spans(export_path)}
+    assert spans['webdriver.clickElement']['parent_span_id'] == spans['query.submit']['span_id']
+    assert spans['webdriver.clickElement']['duration_ms'] >= 0
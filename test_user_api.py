@@ -1,4 +1,11 @@
+import gzip
+import json
+import os
 import pytest
+
+# Keep the browser from starting when the app is imported.
+os.environ.setdefault('STARTUP_MODE', 'lazy')
+
 from main import app, db
 from models import User
 
@@ -114,4 +121,17 @@ def test_delete_user(test_client):
     
     # Verify the user is gone
     get_response = test_client.get(f'/api/users/{user_id}')
-    assert get_response.status_code == 404
\ No newline at end of file
+    assert get_response.status_code == 404
+
+
+def test_get_users_with_fields_and_compression(test_client):
+    """A large user listing can be projected to some fields and is gzip-compressed on request."""
+    for i in range(40):
+        test_client.post('/api/users', json={'username': f"user{i}", 'email': f"user{i}@example.com"})
+    response = test_client.get('/api/users?fields=id,username', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    users = json.loads(gzip.decompress(response.data))
+    assert len(users) == 40
+    assert set(users[0]) == {'id', 'username'}
@@ -0,0 +1,234 @@
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+# Keep the browser from starting when the app is imported.
+os.environ.setdefault('STARTUP_MODE', 'lazy')
+
+import notebooklm
+import webhooks
+from main import app
+from models import db, WebhookDelivery
+from tracing import JsonlExporter, tracer
+from webhooks import WebhookDispatcher, callback_url_error, webhook_dispatcher
+from test_notebooklm_api import FakeDriver
+
+class Receiver(ThreadingHTTPServer):
+    """A local webhook receiver that answers with the queued status codes, then 200."""
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), ReceiverHandler)
+        self.bodies = []
+        self.statuses = []
+        self.received = threading.Condition()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/hook"
+
+    def wait_for(self, count, timeout=5):
+        with self.received:
+            return self.received.wait_for(lambda: len(self.bodies) >= count, timeout)
+
+class ReceiverHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        self.send_response(status)
+        if 300 <= status < 400:
+            self.send_header('Location', 'http://169.254.169.254/latest/meta-data')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+        with self.server.received:
+            self.server.bodies.append(body)
+            self.server.received.notify_all()
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def receiver(monkeypatch):
+    # The receiver listens on loopback, which callbacks may only reach once it is allowed.
+    monkeypatch.setattr(webhooks, 'WEBHOOK_ALLOWED_HOSTS', {'127.0.0.1'})
+    server = Receiver()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def dispatcher():
+    # The app's own dispatcher may have been started by earlier requests; keep it off the test rows.
+    webhook_dispatcher.stop()
+    if webhook_dispatcher.running:
+        webhook_dispatcher._thread.join(5)
+    with app.app_context():
+        # Other test modules drop the tables of the (temporary) test database.
+        db.create_all()
+        WebhookDelivery.query.delete()
+        db.session.commit()
+    dispatcher = WebhookDispatcher(app, max_workers=2, backoff_base=0.05, max_attempts=3,
+                                   batch_size=3, batch_window=0.5, poll_interval=0.05)
+    yield dispatcher
+    dispatcher.stop()
+
+def statuses():
+    with app.app_context():
+        return [delivery.status for delivery in WebhookDelivery.query.order_by(WebhookDelivery.id)]
+
+def test_failed_delivery_is_retried(receiver, dispatcher):
+    receiver.statuses = [500]
+    dispatcher.start()
+    dispatcher.enqueue(receiver.url, {'query_id': 'q1'})
+    assert receiver.wait_for(2)
+    assert receiver.bodies == [{'query_id': 'q1'}, {'query_id': 'q1'}]
+    time.sleep(0.1)
+    assert statuses() == ['delivered']
+
+def test_delivery_gives_up_after_max_attempts(receiver, dispatcher):
+    receiver.statuses = [503, 503, 503]
+    dispatcher.start()
+    dispatcher.enqueue(receiver.url, {'query_id': 'q1'})
+    assert receiver.wait_for(3)
+    time.sleep(0.1)
+    assert statuses() == ['failed']
+    assert dispatcher.snapshot()['recent_failures'][0]['last_error'] == 'HTTP 503'
+
+def test_redirects_are_not_followed(receiver, dispatcher):
+    """A redirect counts as a failed attempt instead of sending the result somewhere else."""
+    receiver.statuses = [307]
+    dispatcher.start()
+    dispatcher.enqueue(receiver.url, {'query_id': 'q1'})
+    assert receiver.wait_for(2)
+    time.sleep(0.1)
+    assert statuses() == ['delivered']
+    with app.app_context():
+        assert WebhookDelivery.query.one().attempts == 2
+
+def test_callback_url_is_checked_again_before_delivery(receiver, dispatcher, monkeypatch):
+    """A callback host that is no longer allowed when its result is sent is not contacted."""
+    dispatcher.enqueue(receiver.url, {'query_id': 'q1'})
+    monkeypatch.setattr(webhooks, 'WEBHOOK_ALLOWED_HOSTS', set())
+    dispatcher.start()
+    time.sleep(0.5)
+    assert receiver.bodies == []
+    assert statuses() == ['failed']
+    assert 'private' in dispatcher.snapshot()['recent_failures'][0]['last_error']
+
+def test_batched_results_share_one_request(receiver, dispatcher):
+    for i in range(3):
+        dispatcher.enqueue(receiver.url, {'query_id': f"q{i}"}, batch=True)
+    dispatcher.start()
+    assert receiver.wait_for(1)
+    assert receiver.bodies == [{'results': [{'query_id': 'q0'}, {'query_id': 'q1'}, {'query_id': 'q2'}]}]
+
+def test_interrupted_deliveries_resume_on_start(receiver, dispatcher):
+    delivery_id = dispatcher.enqueue(receiver.url, {'query_id': 'q1'})
+    with app.app_context():
+        db.session.get(WebhookDelivery, delivery_id).status = 'sending'
+        db.session.commit()
+    # A delivery freshly claimed by another process is not resumed.
+    dispatcher.enqueue(receiver.url, {'query_id': 'q2'})
+    WebhookDispatcher(app)._claim_due()
+    dispatcher.start()
+    assert receiver.wait_for(1)
+    time.sleep(0.2)
+    assert receiver.bodies == [{'query_id': 'q1'}]
+
+def test_delivery_claimed_elsewhere_is_not_sent_twice(receiver, dispatcher, monkeypatch):
+    """A delivery another process claims between reading and claiming it is left to that process."""
+    other = WebhookDispatcher(app)
+    delivery_id = dispatcher.enqueue(receiver.url, {'query_id': 'q1'})
+    due_groups = dispatcher._due_groups
+    claimed_by_other = []
+
+    def read_then_claimed_elsewhere(now):
+        groups = due_groups(now)
+        claimed_by_other.extend(other._claim_due())
+        return groups
+
+    monkeypatch.setattr(dispatcher, '_due_groups', read_then_claimed_elsewhere)
+    assert dispatcher._claim_due() == []
+    assert [delivery_ids for _, delivery_ids, _, _ in claimed_by_other] == [[delivery_id]]
+    assert statuses() == ['sending']
+    # The worker slot taken for the lost claim is given back.
+    assert all(dispatcher._slots.acquire(blocking=False) for _ in range(dispatcher.max_workers))
+
+def test_callback_url_must_not_reach_private_addresses(monkeypatch):
+    assert callback_url_error('ftp://example.com/hook') is not None
+    assert callback_url_error('http://169.254.169.254/latest/meta-data') is not None
+    assert callback_url_error('http://127.0.0.1:8080/hook') is not None
+    assert callback_url_error('http://[::ffff:10.0.0.1]/hook') is not None
+    assert callback_url_error('https://93.184.216.34/hook') is None
+    monkeypatch.setattr(webhooks, 'WEBHOOK_ALLOWED_HOSTS', {'127.0.0.1'})
+    assert callback_url_error('http://127.0.0.1:8080/hook') is None
+
+def test_query_with_callback_url_is_answered_by_webhook(receiver, dispatcher, monkeypatch):
+    """A query with a callback_url returns 202 at once and POSTs the answer when it is ready."""
+    monkeypatch.setattr(notebooklm.default_session, 'driver', FakeDriver(generation_seconds=0.2))
+    monkeypatch.setattr(notebooklm.default_session, 'notebook_url', None)
+    monkeypatch.setattr(notebooklm, 'webhook_dispatcher', dispatcher)
+    dispatcher.start()
+    with app.test_client() as client:
+        response = client.post('/api/query_notebooklm', json={
+            'query': 'What is this?', 'query_id': 'hooked', 'callback_url': receiver.url
+        })
+        assert response.status_code == 202
+        assert response.get_json()['status'] == 'accepted'
+        assert client.post('/api/query_notebooklm', json={
+            'query': 'Q', 'callback_url': 'ftp://example.com'
+        }).status_code == 400
+        assert client.post('/api/query_notebooklm', json={
+            'query': 'Q', 'callback_url': 'http://169.254.169.254/latest/meta-data'
+        }).status_code == 400
+
+    assert receiver.wait_for(1)
+    assert receiver.bodies[0]['query_id'] == 'hooked'
+    assert receiver.bodies[0]['response_content'] == 'The answer.'
+    assert receiver.bodies[0]['status_code'] == 200
+
+def test_callback_query_continues_the_request_trace(receiver, dispatcher, monkeypatch, tmp_path):
+    """The background query of a callback records its spans under the trace id returned with the 202."""
+    export_path = tmp_path / 'traces.jsonl'
+    monkeypatch.setattr(tracer, 'sample_rate', 1)
+    monkeypatch.setattr(tracer, 'exporter', JsonlExporter(str(export_path)))
+    monkeypatch.setattr(notebooklm.default_session, 'driver', FakeDriver())
+    monkeypatch.setattr(notebooklm.default_session, 'notebook_url', None)
+    monkeypatch.setattr(notebooklm, 'webhook_dispatcher', dispatcher)
+    dispatcher.start()
+    with app.test_client() as client:
+        response = client.post('/api/query_notebooklm', json={'query': 'What is this?', 'callback_url': receiver.url})
+    assert response.status_code == 202
+    assert receiver.wait_for(1)
+
+    spans = [json.loads(line) for line in export_path.read_text().splitlines()]
+    names = {span['name'] for span in spans if span['trace_id'] == response.headers['X-Trace-Id']}
+    assert {'http.request', 'query.callback', 'query.lock_wait', 'query.submit'} <= names
+
+def test_callback_queries_are_refused_when_the_queue_is_full(receiver, dispatcher, monkeypatch):
+    monkeypatch.setattr(notebooklm.default_session, 'driver', FakeDriver(generation_seconds=0.3))
+    monkeypatch.setattr(notebooklm.default_session, 'notebook_url', None)
+    monkeypatch.setattr(notebooklm, 'webhook_dispatcher', dispatcher)
+    monkeypatch.setattr(notebooklm, 'callback_query_slots', threading.BoundedSemaphore(1))
+    dispatcher.start()
+    with app.test_client() as client:
+        assert client.post('/api/query_notebooklm', json={
+            'query': 'What is this?', 'query_id': 'first', 'callback_url': receiver.url
+        }).status_code == 202
+        response = client.post('/api/query_notebooklm', json={
+            'query': 'And this?', 'query_id': 'second', 'callback_url': receiver.url
+        })
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '1'
+        assert receiver.wait_for(1)
+        time.sleep(0.1)
+        # The refused query left nothing behind, and the finished one gave its place back.
+        assert client.post('/api/query_notebooklm', json={
+            'query': 'And this?', 'query_id': 'second', 'callback_url': receiver.url
+        }).status_code == 202
+    assert receiver.wait_for(2)
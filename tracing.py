@@ -0,0 +1,159 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Fraction of requests whose spans are recorded and exported (0 disables export, 1 records all).
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', 0))
+TRACE_EXPORT_PATH = os.environ.get(
+    'TRACE_EXPORT_PATH', os.path.join(os.path.dirname(__file__), 'traces', 'traces.jsonl')
+)
+TRACE_ID_HEADER = 'X-Trace-Id'
+
+class Span:
+    """A timed operation within a trace."""
+
+    def __init__(self, trace_id, name, parent_id=None, attributes=None):
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.start_time = time.time()
+        self._started = time.perf_counter()
+        self.duration_ms = None
+        self.error = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def end(self):
+        self.duration_ms = round((time.perf_counter() - self._started) * 1000, 3)
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_span_id': self.parent_id,
+            'name': self.name,
+            'start_time': self.start_time,
+            'duration_ms': self.duration_ms,
+            'attributes': self.attributes,
+            'error': self.error
+        }
+
+class Trace:
+    """The spans recorded for one request. Only sampled traces record spans."""
+
+    def __init__(self, trace_id, sampled):
+        self.trace_id = trace_id
+        self.sampled = sampled
+        self.spans = []
+        self.stack = []
+
+class JsonlExporter:
+    """Appends finished spans to a local JSON Lines file, one span per line."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        lines = ''.join(json.dumps(span.to_dict(), default=str) + '\n' for span in spans)
+        try:
+            with self._lock:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                with open(self.path, 'a', encoding='utf-8') as trace_file:
+                    trace_file.write(lines)
+        except OSError as e:
+            logger.error(f"Could not export trace spans to {self.path}: {e}")
+
+class Tracer:
+    """
+    Creates per-request traces and nested spans. The current trace is kept per thread,
+    which matches how the app serves a request on a single thread.
+    """
+
+    def __init__(self, sample_rate=TRACE_SAMPLE_RATE, exporter=None):
+        self.sample_rate = sample_rate
+        self.exporter = exporter
+        self._local = threading.local()
+
+    @property
+    def current_trace(self):
+        return getattr(self._local, 'trace', None)
+
+    def current_trace_id(self):
+        trace = self.current_trace
+        return trace.trace_id if trace else None
+
+    def start_trace(self, trace_id=None, sampled=None):
+        """Starts a trace on this thread, reusing an incoming trace id if one is given."""
+        if sampled is None:
+            sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        trace = Trace(trace_id or uuid.uuid4().hex, sampled)
+        self._local.trace = trace
+        return trace
+
+    def end_trace(self):
+        """Finishes the thread's trace and exports its spans if it was sampled."""
+        trace = self.current_trace
+        self._local.trace = None
+        if trace and trace.sampled and trace.spans and self.exporter:
+            self.exporter.export(trace.spans)
+        return trace
+
+    def start_span(self, name, **attributes):
+        """Opens a span nested under the current one. Returns None outside a sampled trace."""
+        trace = self.current_trace
+        if not trace or not trace.sampled:
+            return None
+        parent_id = trace.stack[-1].span_id if trace.stack else None
+        span = Span(trace.trace_id, name, parent_id, attributes)
+        trace.stack.append(span)
+        return span
+
+    def end_span(self, span, error=None):
+        if span is None:
+            return
+        trace = self.current_trace
+        span.end()
+        if error is not None:
+            span.error = f"{type(error).__name__}: {error}"
+        if trace and trace.stack and trace.stack[-1] is span:
+            trace.stack.pop()
+            trace.spans.append(span)
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """Records a nested span around a block. Does nothing outside a sampled trace."""
+        span = self.start_span(name, **attributes)
+        try:
+            yield span
+        except BaseException as e:
+            self.end_span(span, e)
+            raise
+        else:
+            self.end_span(span)
+
+    def instrument_driver(self, driver):
+        """
+        Wraps a WebDriver's execute method so every WebDriver command, including those
+        sent through its elements, is recorded as a span with the command name.
+        """
+        execute = driver.execute
+
+        def traced_execute(driver_command, params=None):
+            with self.span(f"webdriver.{driver_command}", command=driver_command):
+                return execute(driver_command, params)
+
+        driver.execute = traced_execute
+        return driver
+
+tracer = Tracer(exporter=JsonlExporter(TRACE_EXPORT_PATH))
@@ -1,13 +1,15 @@
 from flask import Blueprint, jsonify, request
 from models import User, db
+from responses import parse_fields, project_fields
 from sqlalchemy.exc import IntegrityError
 
 user_bp = Blueprint('user', __name__)
 
 @user_bp.route('/users', methods=['GET'])
 def get_users():
+    # An optional ?fields=id,username limits each user to the listed fields.
     users = User.query.all()
-    return jsonify([user.to_dict() for user in users])
+    return jsonify(project_fields([user.to_dict() for user in users], parse_fields(request.args.get('fields'))))
 
 @user_bp.route('/users', methods=['POST'])
 def create_user():
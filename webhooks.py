@@ -0,0 +1,278 @@
+import ipaddress
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from models import db, WebhookDelivery
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_MAX_WORKERS = int(os.environ.get('WEBHOOK_MAX_WORKERS', 4))
+WEBHOOK_MAX_ATTEMPTS = int(os.environ.get('WEBHOOK_MAX_ATTEMPTS', 8))
+# Retry n waits about WEBHOOK_BACKOFF_BASE * 2 ** (n - 1) seconds, capped at WEBHOOK_BACKOFF_MAX.
+WEBHOOK_BACKOFF_BASE = float(os.environ.get('WEBHOOK_BACKOFF_BASE', 2))
+WEBHOOK_BACKOFF_MAX = float(os.environ.get('WEBHOOK_BACKOFF_MAX', 300))
+WEBHOOK_TIMEOUT = float(os.environ.get('WEBHOOK_TIMEOUT', 10))
+# Batched results for the same URL are collected for up to WEBHOOK_BATCH_WINDOW seconds.
+WEBHOOK_BATCH_SIZE = int(os.environ.get('WEBHOOK_BATCH_SIZE', 20))
+WEBHOOK_BATCH_WINDOW = float(os.environ.get('WEBHOOK_BATCH_WINDOW', 2))
+WEBHOOK_POLL_INTERVAL = float(os.environ.get('WEBHOOK_POLL_INTERVAL', 1))
+# Callback hosts that resolve to private, loopback or link-local addresses are refused, so callers
+# cannot make the app POST to cloud metadata endpoints or services on its own network. Hosts in
+# the comma-separated WEBHOOK_ALLOWED_HOSTS (e.g. an internal receiver) are always accepted.
+WEBHOOK_ALLOWED_HOSTS = {
+    host.strip().lower() for host in os.environ.get('WEBHOOK_ALLOWED_HOSTS', '').split(',') if host.strip()
+}
+
+def callback_url_error(url):
+    """
+    Returns why results may not be sent to a callback URL, or None if they may.
+    URLs are checked when a query is submitted and again before every delivery attempt,
+    so a host whose DNS changes to a private address in the meantime is still refused.
+    """
+    parts = urlsplit(url) if isinstance(url, str) else None
+    if not (parts and parts.scheme in ('http', 'https') and parts.hostname):
+        return 'callback_url must be an absolute http or https URL'
+    if parts.hostname.lower() in WEBHOOK_ALLOWED_HOSTS:
+        return None
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(parts.hostname, None, proto=socket.IPPROTO_TCP)}
+    except (socket.gaierror, UnicodeError):
+        return f"callback_url host '{parts.hostname}' could not be resolved"
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split('%')[0])
+        if ip.version == 6 and ip.ipv4_mapped:
+            ip = ip.ipv4_mapped
+        if not ip.is_global or ip.is_multicast:
+            return 'callback_url must not point to a private, loopback or link-local address'
+    return None
+
+class WebhookDispatcher:
+    """
+    Delivers query results to callback URLs from an outbox table in the app's database.
+    A single thread claims due deliveries and hands them to a bounded worker pool, which
+    POSTs them over pooled connections. Failed deliveries are retried with exponential
+    backoff, and deliveries left unfinished by a restart are resumed on start.
+    """
+
+    def __init__(self, app=None, max_workers=WEBHOOK_MAX_WORKERS, max_attempts=WEBHOOK_MAX_ATTEMPTS,
+                 backoff_base=WEBHOOK_BACKOFF_BASE, backoff_max=WEBHOOK_BACKOFF_MAX, timeout=WEBHOOK_TIMEOUT,
+                 batch_size=WEBHOOK_BATCH_SIZE, batch_window=WEBHOOK_BATCH_WINDOW, poll_interval=WEBHOOK_POLL_INTERVAL):
+        self.app = None
+        self.max_workers = max_workers
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.poll_interval = poll_interval
+
+        # Created when dispatching starts, so importing this module does not load requests.
+        self.http = None
+
+        self._slots = threading.BoundedSemaphore(max_workers)
+        self._executor = None
+        self._thread = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['webhooks'] = self
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Starts dispatching. Safe to call more than once."""
+        with self._lock:
+            if self.running:
+                return False
+            with self.app.app_context():
+                # Deliveries that were being sent when the process stopped go back to the queue once
+                # their claim has run out, so ones still being sent by another process are left alone.
+                resumed = (WebhookDelivery.query
+                           .filter(WebhookDelivery.status == 'sending', WebhookDelivery.next_attempt_at <= time.time())
+                           .update({'status': 'pending'}, synchronize_session=False))
+                db.session.commit()
+            if resumed:
+                logger.info(f"Resuming {resumed} interrupted webhook deliveries.")
+            if self.http is None:
+                self.http = self._new_session()
+            self._stop.clear()
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='webhook')
+            self._thread = threading.Thread(target=self._run, name='webhook-dispatcher', daemon=True)
+            self._thread.start()
+            return True
+
+    def _new_session(self):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.max_workers, pool_maxsize=self.max_workers)
+        http.mount('http://', adapter)
+        http.mount('https://', adapter)
+        http.headers['User-Agent'] = 'NotebookLM-Automation-Webhooks'
+        return http
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def enqueue(self, callback_url, payload, batch=False):
+        """Stores a result in the outbox and returns its delivery id."""
+        with self.app.app_context():
+            delivery = WebhookDelivery(callback_url, json.dumps(payload, default=str), batch)
+            db.session.add(delivery)
+            db.session.commit()
+            delivery_id = delivery.id
+        self._wake.set()
+        return delivery_id
+
+    def backoff(self, attempts):
+        """Delay before retry number `attempts`, with jitter so failed receivers are not hit in bursts."""
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.dispatch_due()
+            except Exception as e:
+                logger.error(f"Webhook dispatch failed: {e}", exc_info=True)
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+        self._executor.shutdown(wait=False)
+
+    def dispatch_due(self):
+        """Claims due deliveries and submits them to the worker pool while workers are free."""
+        for callback_url, delivery_ids, payloads, batched in self._claim_due():
+            self._executor.submit(self._deliver, callback_url, delivery_ids, payloads, batched)
+
+    def _due_groups(self, now):
+        """Reads the pending deliveries that are due, grouped into the requests that will send them."""
+        due = (WebhookDelivery.query
+               .filter(WebhookDelivery.status == 'pending', WebhookDelivery.next_attempt_at <= now)
+               .order_by(WebhookDelivery.id)
+               .limit(self.max_workers * self.batch_size)
+               .all())
+        groups, batches = [], {}
+        for delivery in due:
+            if delivery.batch:
+                batches.setdefault(delivery.callback_url, []).append(delivery)
+            else:
+                groups.append([delivery])
+        for deliveries in batches.values():
+            # Hold a partial batch back until its oldest result has waited out the batch window.
+            if len(deliveries) < self.batch_size and now - deliveries[0].created_at < self.batch_window:
+                continue
+            groups.extend(deliveries[i:i + self.batch_size] for i in range(0, len(deliveries), self.batch_size))
+        return groups
+
+    def _claim_due(self):
+        now = time.time()
+        with self.app.app_context():
+            groups = self._due_groups(now)
+
+            # Only claim as many groups as there are free workers; the rest wait for the next pass.
+            claimed = []
+            for deliveries in sorted(groups, key=lambda group: group[0].id):
+                if not self._slots.acquire(blocking=False):
+                    break
+                deliveries = [delivery for delivery in deliveries if self._claim(delivery.id, now)]
+                if not deliveries:
+                    self._slots.release()
+                    continue
+                claimed.append((
+                    deliveries[0].callback_url,
+                    [delivery.id for delivery in deliveries],
+                    [json.loads(delivery.payload) for delivery in deliveries],
+                    deliveries[0].batch
+                ))
+            db.session.commit()
+        return claimed
+
+    def _claim(self, delivery_id, now):
+        """
+        Marks a delivery as being sent if it is still pending. Another process sharing the
+        outbox may have claimed it since it was read, in which case no row is updated.
+        The claim runs out after a few request timeouts, when start() may resume the delivery.
+        """
+        updated = (WebhookDelivery.query
+                   .filter_by(id=delivery_id, status='pending')
+                   .update({'status': 'sending', 'next_attempt_at': now + 3 * self.timeout}, synchronize_session=False))
+        return updated == 1
+
+    def _deliver(self, callback_url, delivery_ids, payloads, batched):
+        import requests
+
+        try:
+            error = callback_url_error(callback_url)
+            if error is None:
+                try:
+                    body = {'results': payloads} if batched else payloads[0]
+                    # Redirects are not followed: they could lead to an address the check above refuses.
+                    response = self.http.post(
+                        callback_url, json=body, timeout=self.timeout, allow_redirects=False,
+                        headers={'X-Webhook-Delivery': ','.join(str(delivery_id) for delivery_id in delivery_ids)}
+                    )
+                    if not 200 <= response.status_code < 300:
+                        error = f"HTTP {response.status_code}"
+                except requests.RequestException as e:
+                    error = f"{type(e).__name__}: {e}"
+            self._record(delivery_ids, error)
+        except Exception as e:
+            logger.error(f"Could not complete webhook delivery {delivery_ids}: {e}", exc_info=True)
+        finally:
+            self._slots.release()
+            self._wake.set()
+
+    def _record(self, delivery_ids, error):
+        now = time.time()
+        with self.app.app_context():
+            for delivery in WebhookDelivery.query.filter(WebhookDelivery.id.in_(delivery_ids)).all():
+                delivery.attempts += 1
+                if error is None:
+                    delivery.status = 'delivered'
+                    delivery.delivered_at = now
+                    delivery.last_error = None
+                elif delivery.attempts >= self.max_attempts:
+                    delivery.status = 'failed'
+                    delivery.last_error = error
+                    logger.error(f"Giving up on webhook delivery {delivery.id} to {delivery.callback_url}: {error}")
+                else:
+                    delivery.status = 'pending'
+                    delivery.last_error = error
+                    delivery.next_attempt_at = now + self.backoff(delivery.attempts)
+                    logger.warning(f"Webhook delivery {delivery.id} failed ({error}), "
+                                   f"retrying in {delivery.next_attempt_at - now:.1f} seconds.")
+            db.session.commit()
+
+    def snapshot(self):
+        """Counts deliveries by status and lists the most recent failures."""
+        with self.app.app_context():
+            counts = dict(
+                db.session.query(WebhookDelivery.status, db.func.count(WebhookDelivery.id))
+                .group_by(WebhookDelivery.status).all()
+            )
+            failures = (WebhookDelivery.query.filter_by(status='failed')
+                        .order_by(WebhookDelivery.id.desc()).limit(10).all())
+            return {
+                'running': self.running,
+                'deliveries': counts,
+                'recent_failures': [delivery.to_dict() for delivery in failures]
+            }
+
+webhook_dispatcher = WebhookDispatcher()